@@ -0,0 +1,175 @@
+"""Benchmark of the history export's comment fetching through the rate limiter.
+
+Runs :class:`telegram_scraper.scrape_history.HistoryExport` on a real
+:class:`telegram_scraper.client.RateLimitedClient` whose network layer is
+replaced by a fake Telegram answering every request after a fixed latency.
+Telethon's ``iter_messages``, the FloodLimiter buckets and Telethon's own
+pacing between chunks all apply, so the numbers show what
+``--comment-concurrency`` buys with the default ``TG_RATE_LIMITS``::
+
+    python benchmarks/bench_history.py --posts 600 --concurrency 1 4 8
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.client.users import UserMethods  # noqa: E402
+from telethon.sessions import StringSession  # noqa: E402
+from telethon.tl import functions, types  # noqa: E402
+
+from telegram_scraper.client import RateLimitedClient  # noqa: E402
+from telegram_scraper.ratelimit import parse_rates  # noqa: E402
+from telegram_scraper.scrape_history import HistoryExport  # noqa: E402
+from telegram_scraper.state import Checkpointer, FileStateStore  # noqa: E402
+
+CHANNEL_ID = 1001
+GROUP_ID = 2002
+USERNAME = "benchchannel"
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeTelegram:
+    """In-memory channel with a discussion group, served with fixed latency."""
+
+    def __init__(self, posts: int, latency: float, seed: int) -> None:
+        rng = random.Random(seed)
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.comments = {}
+        self.posts = []
+        next_comment = 1
+        for post_id in range(1, posts + 1):
+            # About a third of the posts have no comments.
+            count = rng.choice([0, 0, 1, 2, 3, 5, 8, 20, 40])
+            self.comments[post_id] = [
+                types.Message(
+                    id=next_comment + i,
+                    peer_id=types.PeerChannel(GROUP_ID),
+                    date=START + timedelta(minutes=post_id, seconds=i),
+                    message=f"comment {i} on {post_id}",
+                    from_id=types.PeerUser(10 + i),
+                )
+                for i in range(count)
+            ]
+            next_comment += count
+            self.posts.append(
+                types.Message(
+                    id=post_id,
+                    peer_id=types.PeerChannel(CHANNEL_ID),
+                    date=START + timedelta(minutes=post_id),
+                    message=f"post {post_id}",
+                    views=100,
+                    replies=types.MessageReplies(
+                        replies=count, replies_pts=0, comments=True, channel_id=GROUP_ID
+                    ),
+                )
+            )
+        self.channel = types.Channel(
+            id=CHANNEL_ID,
+            title="Bench",
+            photo=types.ChatPhotoEmpty(),
+            date=START,
+            access_hash=1,
+            username=USERNAME,
+            broadcast=True,
+        )
+
+    @staticmethod
+    def _window(messages, offset_id: int, add_offset: int, limit: int):
+        """Slice of ``messages`` the way Telegram pages history, newest first."""
+        newest_first = sorted(messages, key=lambda m: m.id, reverse=True)
+        start = 0
+        if offset_id:
+            start = next((i for i, m in enumerate(newest_first) if m.id < offset_id), len(newest_first))
+        start = max(0, start + add_offset)
+        return newest_first[start:start + limit]
+
+    def answer(self, request):
+        name = type(request).__name__
+        self.calls[name] += 1
+        if isinstance(request, functions.contacts.ResolveUsernameRequest):
+            return types.contacts.ResolvedPeer(
+                peer=types.PeerChannel(CHANNEL_ID), chats=[self.channel], users=[]
+            )
+        if isinstance(request, functions.messages.GetHistoryRequest):
+            source = self.posts
+        elif isinstance(request, functions.messages.GetRepliesRequest):
+            source = self.comments[request.msg_id]
+        else:
+            raise NotImplementedError(name)
+        page = self._window(source, request.offset_id, request.add_offset, request.limit)
+        return types.messages.ChannelMessages(
+            pts=0, count=len(source), messages=page, topics=[], chats=[self.channel], users=[]
+        )
+
+
+async def _fake_call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+    """Stands in for Telethon's network round trip below RateLimitedClient._call."""
+    await asyncio.sleep(self.fake.latency)
+    result = self.fake.answer(request)
+    self.session.process_entities(result)
+    return result
+
+
+class _NullWriter:
+    def __init__(self) -> None:
+        self.rows = 0
+        self.comments = 0
+
+    async def write(self, chat: str, row) -> None:
+        self.rows += 1
+        self.comments += row["Comments List"].count("Comment Message ID")
+
+
+async def run(posts: int, latency: float, concurrency: int, rates, seed: int) -> dict:
+    fake = FakeTelegram(posts, latency, seed)
+    client = RateLimitedClient(StringSession(), 1, "0" * 32, rate_limits=rates)
+    client.fake = fake
+    writer = _NullWriter()
+    with tempfile.TemporaryDirectory() as tmp:
+        state = Checkpointer(FileStateStore(os.path.join(tmp, "state.json")), 60, 1000)
+        export = HistoryExport(
+            client, state, writer, "bench", None, None, None, 0, concurrency
+        )
+        started = time.monotonic()
+        await export.run([f"@{USERNAME}"])
+        elapsed = time.monotonic() - started
+    return {
+        "comment_concurrency": concurrency,
+        "posts": writer.rows,
+        "comments": writer.comments,
+        "comment_fetches": export.comment_fetches,
+        "requests": dict(fake.calls),
+        "seconds": round(elapsed, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--posts", type=int, default=600)
+    parser.add_argument("--latency-ms", type=float, default=20, help="Fake Telegram round trip")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--rates", default="", help="TG_RATE_LIMITS overrides")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    UserMethods._call = _fake_call
+    rates = parse_rates(args.rates)
+    for concurrency in args.concurrency:
+        result = asyncio.run(run(args.posts, args.latency_ms / 1000, concurrency, rates, args.seed))
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""End-to-end throughput benchmark for the live pipeline.
+
+Synthetic (or recorded) messages are pushed through a stub Telethon client
+into the real ``register_handlers`` pipeline: outbox, album scheduler,
+delivery queue, media download and ``sender``. Deliveries go to a local
+aiohttp stand-in for the n8n webhook with configurable latency and error
+rate. The run reports messages/sec, p50/p99 end-to-end latency (event
+received -> webhook acknowledged) and peak RSS.
+
+Example::
+
+    python benchmarks/bench_pipeline.py --messages 5000 --channels 20 \\
+        --album-every 10 --media-kb 256 --send-mode multipart \\
+        --webhook-latency-ms 20 --webhook-error-rate 0.01
+
+``--replay FILE`` reads messages from a JSON-lines file instead, one object
+per line with ``chat``, ``id`` and optionally ``text``, ``grouped_id`` and
+``media_bytes``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon import events  # noqa: E402
+
+WEBHOOK_PORT = 8769
+CHANNEL_ID_BASE = -1000000000000
+
+
+class FakeFile:
+    def __init__(self, size: int, chat: str, msg_id: int) -> None:
+        self.size = size
+        # Message ids repeat across channels; downloads share one directory.
+        self.name = f"{chat}-{msg_id}.bin"
+        self.ext = ".bin"
+        self.mime_type = "application/octet-stream"
+        self.width = self.height = self.duration = None
+
+
+class FakeMessage:
+    """The subset of ``telethon.tl.custom.Message`` the pipeline reads."""
+
+    def __init__(
+        self,
+        chat: str,
+        chat_id: int,
+        msg_id: int,
+        text: str,
+        grouped_id: Optional[int],
+        media_bytes: int,
+    ) -> None:
+        self.chat_username = chat
+        self.chat_id = chat_id
+        self.id = msg_id
+        self.message = self.text = text
+        self.grouped_id = grouped_id
+        self.media = object() if media_bytes else None
+        self.file = FakeFile(media_bytes, chat, msg_id) if media_bytes else None
+        self.size = media_bytes
+        self.date = datetime.now(timezone.utc)
+        self.post_author = None
+        self.views = 0
+        self.reactions = None
+        self.forwards = 0
+        self.from_id = None
+        self.sender_id = None
+
+
+class FakeEvent:
+    def __init__(self, client: "FakeClient", chat_id: int, message: FakeMessage) -> None:
+        self.client = client
+        self.chat_id = chat_id
+        self.message = message
+
+
+class FakeClient:
+    """Stub ``TelegramClient`` serving media from memory."""
+
+    def __init__(self, download_latency: float) -> None:
+        self.download_latency = download_latency
+        self.on_message = None
+
+    def add_event_handler(self, callback, event=None) -> None:
+        if isinstance(event, events.NewMessage):
+            self.on_message = callback
+
+    async def download_media(self, msg, path, **kwargs):
+        await asyncio.sleep(self.download_latency)
+        target = os.path.join(path, msg.file.name) if os.path.isdir(path) else path
+        with open(target, "wb") as fh:
+            fh.write(os.urandom(msg.size))
+        return target
+
+    async def iter_download(self, msg, chunk_size: int = 128 * 1024, **kwargs):
+        await asyncio.sleep(self.download_latency)
+        for offset in range(0, msg.size, chunk_size):
+            yield os.urandom(min(chunk_size, msg.size - offset))
+
+    async def get_messages(self, chat, ids):
+        return []
+
+
+def synthetic_messages(args) -> List[Dict]:
+    rng = random.Random(args.seed)
+    rows: List[Dict] = []
+    next_id: Dict[str, int] = {}
+    group = 0
+    while len(rows) < args.messages:
+        chat = f"bench{rng.randrange(args.channels)}"
+        album = args.album_every and rng.randrange(args.album_every) == 0
+        parts = args.album_size if album else 1
+        group += 1
+        for _ in range(parts):
+            next_id[chat] = next_id.get(chat, 0) + 1
+            rows.append(
+                {
+                    "chat": chat,
+                    "id": next_id[chat],
+                    "text": "x" * args.text_bytes,
+                    "grouped_id": group if album else None,
+                    "media_bytes": args.media_kb * 1024 if album or args.media_every_message else 0,
+                }
+            )
+    return rows[: args.messages]
+
+
+def load_replay(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Webhook:
+    """Local stand-in for n8n recording when each message was acknowledged."""
+
+    def __init__(self, latency: float, error_rate: float, seed: int) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.acked: Dict[tuple, float] = {}
+        self.requests = 0
+        self.errors = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if request.content_type.startswith("multipart"):
+            payloads = []
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == "payload":
+                    payloads.append(json.loads(await part.text()))
+                else:
+                    while await part.read_chunk():
+                        pass
+        elif request.content_type == "application/x-ndjson":
+            payloads = [json.loads(line) for line in (await request.text()).splitlines()]
+        else:
+            body = await request.json()
+            payloads = body if isinstance(body, list) else [body]
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503)
+        now = time.monotonic()
+        for payload in payloads:
+            self.acked.setdefault((payload["group"], payload["message_id"]), now)
+        return web.Response(text="ok")
+
+
+async def run(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    rows = load_replay(args.replay) if args.replay else synthetic_messages(args)
+    channels = sorted({r["chat"] for r in rows})
+    os.environ.update(
+        {
+            "TG_API_ID": "1",
+            "TG_API_HASH": "bench",
+            "TG_CHANNELS": ",".join(channels),
+            "N8N_WEBHOOK_URL": f"http://127.0.0.1:{WEBHOOK_PORT}/",
+            "HTTP_BACKOFF_SECONDS": "0",
+            "MEDIA_DIR": os.path.join(workdir, "media"),
+            "MEDIA_CACHE_DIR": os.path.join(workdir, "cache"),
+            "MEDIA_CACHE_MB": "0",
+            "MEDIA_SEND_MODE": args.send_mode,
+            "MEDIA_DOWNLOAD": "1",
+            "STATE_FILE": os.path.join(workdir, "state.json"),
+            "STATE_DB": os.path.join(workdir, "state.sqlite3"),
+            "OUTBOX_DIR": os.path.join(workdir, "outbox"),
+            "CHAT_CACHE_FILE": os.path.join(workdir, "chats.json"),
+            "DELIVERY_WORKERS": str(args.workers),
+            "DELIVERY_STATS_SEC": "0",
+            "CATCHUP_CONCURRENCY": "0",
+            "ALBUM_DEBOUNCE_SEC": "1",
+            "LOG_LEVEL": "WARNING",
+        }
+    )
+    for name, value in args.env:
+        os.environ[name] = value
+
+    from telegram_scraper.client import ClientPool
+    from telegram_scraper.config import load_config
+    from telegram_scraper.entities import ChatDirectory
+    from telegram_scraper.events import register_handlers
+    from telegram_scraper.sender import close_session
+    from telegram_scraper.utils import setup_logging
+
+    config = load_config(os.path.join(workdir, ".env"))
+    setup_logging(config.log_level)
+
+    webhook = Webhook(args.webhook_latency_ms / 1000, args.webhook_error_rate, args.seed)
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post("/", webhook.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", WEBHOOK_PORT).start()
+
+    client = FakeClient(args.download_latency_ms / 1000)
+    pool = ClientPool({"bench": client})
+    chats = ChatDirectory(config.chat_cache_file)
+    peer_ids = {chat: CHANNEL_ID_BASE - i for i, chat in enumerate(channels)}
+    with open(config.chat_cache_file, "w", encoding="utf-8") as fh:
+        json.dump({str(pid): {"channel": c, "username": c, "title": c} for c, pid in peer_ids.items()}, fh)
+    chats.load()
+    pipeline = register_handlers(pool, config, chats)
+
+    received: Dict[tuple, float] = {}
+    # Albums are acknowledged under the id of their first part.
+    ack_key: Dict[tuple, tuple] = {}
+    firsts: Dict[int, tuple] = {}
+    # Telethon dispatches every update in its own task (sequential_updates
+    # is off by default), so handlers for different messages overlap.
+    handlers = []
+    interval = 1 / args.rate if args.rate else 0
+    started = time.monotonic()
+    for row in rows:
+        msg = FakeMessage(
+            row["chat"],
+            peer_ids[row["chat"]],
+            row["id"],
+            row.get("text", ""),
+            row.get("grouped_id"),
+            row.get("media_bytes", 0),
+        )
+        key = (row["chat"], row["id"])
+        gid = row.get("grouped_id")
+        ack_key[key] = firsts.setdefault(gid, key) if gid else key
+        received[key] = time.monotonic()
+        event = FakeEvent(client, peer_ids[row["chat"]], msg)
+        handlers.append(asyncio.ensure_future(client.on_message(event)))
+        await asyncio.sleep(interval)
+    await asyncio.gather(*handlers)
+    injected = time.monotonic()
+
+    expected = set(ack_key.values())
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline and not expected <= webhook.acked.keys():
+        await asyncio.sleep(0.05)
+    finished = time.monotonic()
+
+    await pipeline.close(timeout=5)
+    await close_session()
+    await runner.cleanup()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [
+        webhook.acked[ack_key[k]] - t for k, t in received.items() if ack_key[k] in webhook.acked
+    ]
+    delivered = sum(1 for k in received if ack_key[k] in webhook.acked)
+    last_ack = max(webhook.acked.values(), default=finished)
+    return {
+        "messages": len(rows),
+        "delivered": delivered,
+        "webhook_requests": webhook.requests,
+        "webhook_errors": webhook.errors,
+        "inject_seconds": round(injected - started, 3),
+        "total_seconds": round(last_ack - started, 3),
+        "messages_per_sec": round(delivered / max(last_ack - started, 1e-9), 1),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _env_pair(value: str):
+    name, _, setting = value.partition("=")
+    return name, setting
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--album-every", type=int, default=0, help="1 in N groups is an album (0: none)")
+    parser.add_argument("--album-size", type=int, default=4)
+    parser.add_argument("--media-kb", type=int, default=0, help="media size of album parts")
+    parser.add_argument(
+        "--media-every-message", action="store_true", help="attach media to single messages too"
+    )
+    parser.add_argument("--text-bytes", type=int, default=200)
+    parser.add_argument("--send-mode", default="multipart", choices=["multipart", "stream", "preview", "json"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0, help="messages injected per second (0: as fast as possible)")
+    parser.add_argument("--webhook-latency-ms", type=float, default=0)
+    parser.add_argument("--webhook-error-rate", type=float, default=0)
+    parser.add_argument("--download-latency-ms", type=float, default=0)
+    parser.add_argument("--replay", help="JSON-lines file of recorded messages")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--env", type=_env_pair, action="append", default=[], help="extra NAME=VALUE settings"
+    )
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Micro-benchmark of building and encoding one webhook payload.
+
+Compares the inline payload dict the handlers used to build (``strftime``,
+reaction formatting and ``json.dumps`` on every message) with
+:func:`telegram_scraper.record.build_payload` and ``encode_json``. Reports
+CPU time and bytes allocated per message for each step. ``--stdlib-json``
+measures the standard library fallback used when ``orjson`` is missing::
+
+    python benchmarks/bench_record.py --iterations 200000
+    python benchmarks/bench_record.py --iterations 200000 --stdlib-json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon.tl.types import (  # noqa: E402
+    Message,
+    MessageReactions,
+    PeerChannel,
+    PeerUser,
+    ReactionCount,
+    ReactionEmoji,
+)
+
+from telegram_scraper import record  # noqa: E402
+from telegram_scraper.utils import format_reaction, sanitize_text  # noqa: E402
+
+
+def sample_message(reactions: bool) -> Message:
+    return Message(
+        id=123456,
+        peer_id=PeerChannel(1234567890),
+        date=datetime(2024, 5, 17, 12, 30, 45, tzinfo=timezone.utc),
+        message="Пример сообщения с текстом средней длины " * 4,
+        from_id=PeerUser(987654321),
+        post_author="Editor",
+        views=15234,
+        forwards=42,
+        reactions=MessageReactions(
+            results=[
+                ReactionCount(reaction=ReactionEmoji("👍"), count=120),
+                ReactionCount(reaction=ReactionEmoji("🔥"), count=37),
+            ]
+        )
+        if reactions
+        else None,
+    )
+
+
+def legacy_payload(chat: str, msg) -> dict:
+    """The payload dict as ``events.handler`` built it before build_payload."""
+    author_id = None
+    if getattr(msg, "from_id", None) and hasattr(msg.from_id, "user_id"):
+        author_id = msg.from_id.user_id
+    has_media = bool(msg.media)
+    return {
+        "group": chat,
+        "author_id": author_id,
+        "content": sanitize_text(msg.message),
+        "date": msg.date.strftime("%Y-%m-%d %H:%M:%S"),
+        "message_id": msg.id,
+        "author": msg.post_author,
+        "views": msg.views,
+        "reactions": " ".join(
+            format_reaction(r) for r in getattr(msg.reactions, "results", [])
+        ),
+        "shares": msg.forwards,
+        "media": has_media,
+        "url": f"https://t.me/{chat}/{msg.id}",
+        "comments_list": [],
+        "album_group_id": None,
+        "has_media": has_media,
+        "media_count": 1 if has_media else 0,
+    }
+
+
+def legacy_encode(payload: dict) -> bytes:
+    # What aiohttp's ``json=`` argument did with the dict.
+    return json.dumps(payload).encode("utf-8")
+
+
+def per_call_us(fn, iterations: int) -> float:
+    return min(timeit.repeat(fn, number=iterations, repeat=7)) / iterations * 1e6
+
+
+def per_call_bytes(fn, iterations: int) -> float:
+    """Bytes allocated per call (sum of peaks of single calls)."""
+    fn()
+    tracemalloc.start()
+    total = 0
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return total / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=100000)
+    parser.add_argument("--no-reactions", action="store_true")
+    parser.add_argument(
+        "--stdlib-json", action="store_true", help="Encode with the json fallback, as without orjson"
+    )
+    args = parser.parse_args()
+
+    encode_json = record._stdlib_encode if args.stdlib_json else record.encode_json
+    encoder = "json" if args.stdlib_json else record.JSON_ENCODER
+    build_payload = record.build_payload
+    chat = "example_channel"
+    msg = sample_message(not args.no_reactions)
+    old = legacy_payload(chat, msg)
+    new = build_payload(chat, [msg])
+    assert json.loads(legacy_encode(old)) == json.loads(encode_json(new)), "payloads differ"
+
+    cases = {
+        "build (legacy dict)": lambda: legacy_payload(chat, msg),
+        "build (build_payload)": lambda: build_payload(chat, [msg]),
+        "encode (json.dumps)": lambda: legacy_encode(old),
+        f"encode ({encoder})": lambda: encode_json(new),
+        "build+encode (legacy)": lambda: legacy_encode(legacy_payload(chat, msg)),
+        "build+encode (build_payload)": lambda: encode_json(build_payload(chat, [msg])),
+    }
+    alloc_iterations = max(1, args.iterations // 20)
+    print(f"{'step':32} {'us/msg':>8} {'bytes/msg':>10}")
+    for name, fn in cases.items():
+        print(
+            f"{name:32} {per_call_us(fn, args.iterations):8.2f} "
+            f"{per_call_bytes(fn, alloc_iterations):10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
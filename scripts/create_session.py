@@ -1,11 +1,13 @@
 import os
+import sys
 from telethon.sync import TelegramClient
 from pathlib import Path
 
 api_id = int(os.environ.get("TG_API_ID"))
 api_hash = os.environ.get("TG_API_HASH")
 
-session_path = Path("./sessions/zhito_admin")
+session_name = sys.argv[1] if len(sys.argv) > 1 else "zhito_admin"
+session_path = Path("./sessions") / session_name
 client = TelegramClient(session_path, api_id, api_hash)
 
 with client:
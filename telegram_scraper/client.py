@@ -1,11 +1,270 @@
-"""Telethon client factory."""
+"""Telethon client factory and multi-session pool."""
 from __future__ import annotations
 
+import asyncio
+import bisect
+import hashlib
+import logging
+import time
 from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
 from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+
+from .config import Config
+from .ratelimit import FloodLimiter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Virtual nodes per session on the hash ring; smooths the channel split.
+RING_REPLICAS = 64
+
+
+class RateLimitedClient(TelegramClient):
+    """``TelegramClient`` whose API calls go through a :class:`FloodLimiter`.
+
+    Telethon's own flood sleeping is disabled (``flood_sleep_threshold=0``)
+    so every FloodWait reaches the limiter. Waits up to ``flood_sleep_max``
+    seconds are slept and the call is retried; longer ones are raised so the
+    pool can move the work to another session.
+    """
+
+    def __init__(
+        self,
+        *args,
+        rate_limits: Optional[Dict[str, float]] = None,
+        flood_sleep_max: float = 60,
+        **kwargs,
+    ) -> None:
+        kwargs["flood_sleep_threshold"] = 0
+        super().__init__(*args, **kwargs)
+        self.limiter = FloodLimiter(rate_limits)
+        self.flood_sleep_max = flood_sleep_max
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        first = request[0] if isinstance(request, list) else request
+        while True:
+            bucket = await self.limiter.acquire(first)
+            try:
+                result = await super()._call(sender, request, ordered, flood_sleep_threshold)
+            except FloodWaitError as exc:
+                bucket.flood(exc.seconds)
+                # Telethon remembers the wait and would fail early on retry.
+                self._flood_waited_requests.pop(first.CONSTRUCTOR_ID, None)
+                if exc.seconds > self.flood_sleep_max:
+                    raise
+                continue
+            bucket.succeeded()
+            return result
+
+
+def get_client(
+    api_id: int,
+    api_hash: str,
+    session: str = "zhito_admin",
+    rate_limits: Optional[Dict[str, float]] = None,
+    flood_sleep_max: float = 60,
+) -> TelegramClient:
+    """Create a Telethon client instance for a session file in ``./sessions``."""
+    session_path = Path("./sessions") / session
+    return RateLimitedClient(
+        session_path,
+        api_id,
+        api_hash,
+        rate_limits=rate_limits,
+        flood_sleep_max=flood_sleep_max,
+    )
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class ClientPool:
+    """Several Telethon clients, one per session file.
+
+    Channels are assigned to sessions by consistent hashing, so adding or
+    removing a session only moves the channels of that session. A session
+    that hits a FloodWait is skipped until the wait is over and its channels
+    fall through to the next session on the ring. Media downloads go to the
+    available session with the fewest downloads in flight.
+    """
+
+    def __init__(self, clients: Dict[str, TelegramClient]) -> None:
+        if not clients:
+            raise ValueError("ClientPool needs at least one session")
+        self.clients = clients
+        self._ring: List[Tuple[int, str]] = sorted(
+            (_hash(f"{name}#{i}"), name)
+            for name in clients
+            for i in range(RING_REPLICAS)
+        )
+        self._keys = [h for h, _ in self._ring]
+        self._flooded_until: Dict[str, float] = {}
+        self._inflight: Dict[str, int] = {name: 0 for name in clients}
+
+    @classmethod
+    def from_config(cls, config: Config) -> "ClientPool":
+        return cls(
+            {
+                name: get_client(
+                    config.api_id,
+                    config.api_hash,
+                    name,
+                    config.tg_rate_limits,
+                    config.tg_flood_sleep_max,
+                )
+                for name in config.sessions
+            }
+        )
+
+    @property
+    def primary(self) -> TelegramClient:
+        return next(iter(self.clients.values()))
+
+    def available(self, name: str) -> bool:
+        return self._flooded_until.get(name, 0) <= time.monotonic()
+
+    def mark_flood(self, name: str, seconds: float) -> None:
+        """Take ``name`` out of rotation for ``seconds``."""
+        self._flooded_until[name] = time.monotonic() + seconds
+        logger.warning("session %s hit FloodWait of %ss, rerouting its work", name, seconds)
+
+    def owner(self, channel: str) -> str:
+        """Return the session responsible for ``channel`` right now."""
+        start = bisect.bisect(self._keys, _hash(channel.lower()))
+        fallback = None
+        for i in range(len(self._ring)):
+            _, name = self._ring[(start + i) % len(self._ring)]
+            if fallback is None:
+                fallback = name
+            if self.available(name):
+                return name
+        return fallback  # type: ignore[return-value]
+
+    def shards(self, channels: List[str]) -> Dict[str, List[str]]:
+        """Group ``channels`` by their current owner."""
+        result: Dict[str, List[str]] = {name: [] for name in self.clients}
+        for channel in channels:
+            result[self.owner(channel)].append(channel)
+        return result
+
+    def _remaining(self, name: str) -> float:
+        return max(self._flooded_until.get(name, 0) - time.monotonic(), 0.0)
+
+    def _least_loaded(self) -> Tuple[Optional[str], float]:
+        ready = [n for n in self.clients if self.available(n)]
+        if ready:
+            return min(ready, key=lambda n: self._inflight[n]), 0.0
+        return None, min(self._remaining(n) for n in self.clients)
+
+    async def run_owned(self, channel: str, call: Callable[[TelegramClient], Awaitable[T]]) -> T:
+        """Run ``call(client)`` on the owner of ``channel``, failing over on FloodWait."""
+        while True:
+            name = self.owner(channel)
+            if not self.available(name):
+                await asyncio.sleep(self._remaining(name))
+                continue
+            try:
+                return await call(self.clients[name])
+            except FloodWaitError as exc:
+                self.mark_flood(name, exc.seconds)
+
+    async def run_download(
+        self, msg, call: Callable[[TelegramClient, object], Awaitable[T]]
+    ) -> T:
+        """Run ``call(client, message)`` on the least-loaded session.
+
+        When the chosen session is not the one that received ``msg`` the
+        message is fetched again through it, since file references belong to
+        the account that fetched them. FloodWait moves the call to another
+        session.
+        """
+        while True:
+            name, wait = self._least_loaded()
+            if name is None:
+                await asyncio.sleep(wait)
+                continue
+            client = self.clients[name]
+            self._inflight[name] += 1
+            try:
+                return await call(client, await self._localise(client, msg))
+            except FloodWaitError as exc:
+                self.mark_flood(name, exc.seconds)
+            finally:
+                self._inflight[name] -= 1
+
+    async def _localise(self, client: TelegramClient, msg):
+        owner = getattr(msg, "_client", None)
+        if owner is None or owner is client:
+            return msg
+        chat = getattr(getattr(msg, "chat", None), "username", None) or msg.chat_id
+        try:
+            fetched = await client.get_messages(chat, ids=msg.id)
+        except FloodWaitError:
+            raise
+        except Exception as exc:  # pragma: no cover - best effort
+            logger.debug("could not refetch message %s via another session: %s", msg.id, exc)
+            fetched = None
+        return fetched or msg
+
+    def media_client(self) -> "PooledMediaClient":
+        return PooledMediaClient(self)
+
+    async def start(self) -> None:
+        for client in self.clients.values():
+            await client.start()
+
+    async def run_until_disconnected(self) -> None:
+        """Return as soon as any session disconnects."""
+        tasks = [
+            asyncio.ensure_future(c.run_until_disconnected()) for c in self.clients.values()
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def disconnect(self) -> None:
+        await asyncio.gather(
+            *(c.disconnect() for c in self.clients.values()), return_exceptions=True
+        )
+
+
+class PooledMediaClient:
+    """Stand-in for a ``TelegramClient`` that spreads downloads over a pool.
+
+    Only the download methods are routed; any other attribute is taken from
+    the primary session.
+    """
+
+    def __init__(self, pool: ClientPool) -> None:
+        self.pool = pool
+
+    async def download_media(self, msg, *args, **kwargs):
+        return await self.pool.run_download(
+            msg, lambda client, m: client.download_media(m, *args, **kwargs)
+        )
+
+    async def run_download(self, msg, call: Callable[[TelegramClient, object], Awaitable[T]]) -> T:
+        return await self.pool.run_download(msg, call)
 
+    async def iter_download(self, msg, **kwargs) -> AsyncIterator[bytes]:
+        name, _ = self.pool._least_loaded()
+        name = name or next(iter(self.pool.clients))
+        client = self.pool.clients[name]
+        self.pool._inflight[name] += 1
+        try:
+            local = await self.pool._localise(client, msg)
+            async for chunk in client.iter_download(local, **kwargs):
+                yield chunk
+        finally:
+            self.pool._inflight[name] -= 1
 
-def get_client(api_id: int, api_hash: str) -> TelegramClient:
-    """Create a Telethon client instance using a fixed session file."""
-    session_path = Path("./sessions/zhito_admin")
-    return TelegramClient(session_path, api_id, api_hash)
+    def __getattr__(self, name: str):
+        return getattr(self.pool.primary, name)
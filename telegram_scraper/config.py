@@ -2,30 +2,70 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, List
 import os
 
 from dotenv import load_dotenv
 
+from .ratelimit import parse_rates
+
 
 @dataclass
 class Config:
     api_id: int
     api_hash: str
     channels: List[str]
+    sessions: List[str]
+    tg_rate_limits: Dict[str, float]
+    tg_flood_sleep_max: int
+    shards: int
+    shard_restart_sec: int
+    chat_cache_file: str
+    catchup_concurrency: int
+    catchup_wait_sec: float
     webhook_url: str
     http_timeout: int
     http_max_retries: int
     http_backoff_seconds: int
+    http_pool_size: int
+    http_keepalive_seconds: int
+    webhook_batch_size: int
+    webhook_batch_ms: int
+    webhook_batch_format: str
     log_level: str
+    metrics_host: str
+    metrics_port: int
     state_backend: str
     state_file: str
+    state_db: str
+    state_flush_every: int
+    state_flush_ms: int
+    thread_state_file: str
     thread_message_id: int | None
     media_download: bool
     media_dir: str
     media_max_mb: int
     media_send_mode: str
+    media_preview_min_px: int
+    media_concurrency: int
+    media_parallel_connections: int
+    media_parallel_min_mb: int
+    media_cache_dir: str
+    media_cache_mb: int
+    media_retention_mb: int
+    media_retention_hours: int
+    media_delete_after_send: bool
+    media_janitor_sec: int
+    media_stream_chunk_kb: int
+    media_stream_buffer_chunks: int
     album_debounce_sec: int
+    album_max_buffered: int
+    delivery_workers: int
+    delivery_queue_size: int
+    delivery_stats_sec: int
+    outbox_dir: str
+    outbox_fsync_ms: int
+    outbox_segment_mb: int
 
 
 def _require(name: str) -> str:
@@ -41,6 +81,10 @@ def load_config(env_file: str = ".env") -> Config:
 
     channels = [c.strip().lstrip("@") for c in _require("TG_CHANNELS").split(",") if c.strip()]
 
+    sessions = [
+        s.strip() for s in os.getenv("TG_SESSIONS", "zhito_admin").split(",") if s.strip()
+    ]
+
     thread_env = os.getenv("THREAD_MESSAGE_ID")
     thread_message_id = int(thread_env) if thread_env else None
 
@@ -48,19 +92,57 @@ def load_config(env_file: str = ".env") -> Config:
         api_id=int(_require("TG_API_ID")),
         api_hash=_require("TG_API_HASH"),
         channels=channels,
+        sessions=sessions,
+        tg_rate_limits=parse_rates(os.getenv("TG_RATE_LIMITS", "")),
+        tg_flood_sleep_max=int(os.getenv("TG_FLOOD_SLEEP_MAX", "60")),
+        shards=max(1, int(os.getenv("SHARDS", "1"))),
+        shard_restart_sec=int(os.getenv("SHARD_RESTART_SEC", "5")),
+        chat_cache_file=os.getenv("CHAT_CACHE_FILE", "./data/chats.json"),
+        catchup_concurrency=int(os.getenv("CATCHUP_CONCURRENCY", "4")),
+        catchup_wait_sec=float(os.getenv("CATCHUP_WAIT_SEC", "1")),
         webhook_url=_require("N8N_WEBHOOK_URL"),
         http_timeout=int(os.getenv("HTTP_TIMEOUT", "10")),
         http_max_retries=int(os.getenv("HTTP_MAX_RETRIES", "5")),
         http_backoff_seconds=int(os.getenv("HTTP_BACKOFF_SECONDS", "2")),
+        http_pool_size=int(os.getenv("HTTP_POOL_SIZE", "10")),
+        http_keepalive_seconds=int(os.getenv("HTTP_KEEPALIVE_SECONDS", "30")),
+        webhook_batch_size=int(os.getenv("WEBHOOK_BATCH_SIZE", "1")),
+        webhook_batch_ms=int(os.getenv("WEBHOOK_BATCH_MS", "500")),
+        webhook_batch_format=os.getenv("WEBHOOK_BATCH_FORMAT", "json").lower(),
         log_level=os.getenv("LOG_LEVEL", "INFO"),
+        metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+        metrics_port=int(os.getenv("METRICS_PORT", "0")),
         state_backend=os.getenv("STATE_BACKEND", "file"),
         state_file=os.getenv("STATE_FILE", ".state.json"),
+        state_db=os.getenv("STATE_DB", "./data/state.sqlite3"),
+        state_flush_every=int(os.getenv("STATE_FLUSH_EVERY", "100")),
+        state_flush_ms=int(os.getenv("STATE_FLUSH_MS", "1000")),
+        thread_state_file=os.getenv("THREAD_STATE_FILE", "./data/thread_state.json"),
         thread_message_id=thread_message_id,
         media_download=os.getenv("MEDIA_DOWNLOAD", "1") == "1",
         media_dir=os.getenv("MEDIA_DIR", "./data/media"),
         media_max_mb=int(os.getenv("MEDIA_MAX_MB", "50")),
         media_send_mode=os.getenv("MEDIA_SEND_MODE", "multipart").lower(),
+        media_preview_min_px=int(os.getenv("MEDIA_PREVIEW_MIN_PX", "320")),
+        media_concurrency=int(os.getenv("MEDIA_CONCURRENCY", "4")),
+        media_parallel_connections=int(os.getenv("MEDIA_PARALLEL_CONNECTIONS", "4")),
+        media_parallel_min_mb=int(os.getenv("MEDIA_PARALLEL_MIN_MB", "10")),
+        media_cache_dir=os.getenv("MEDIA_CACHE_DIR", "./data/media_cache"),
+        media_cache_mb=int(os.getenv("MEDIA_CACHE_MB", "1024")),
+        media_retention_mb=int(os.getenv("MEDIA_RETENTION_MB", "5120")),
+        media_retention_hours=int(os.getenv("MEDIA_RETENTION_HOURS", "72")),
+        media_delete_after_send=os.getenv("MEDIA_DELETE_AFTER_SEND", "1") == "1",
+        media_janitor_sec=int(os.getenv("MEDIA_JANITOR_SEC", "60")),
+        media_stream_chunk_kb=int(os.getenv("MEDIA_STREAM_CHUNK_KB", "512")),
+        media_stream_buffer_chunks=int(os.getenv("MEDIA_STREAM_BUFFER_CHUNKS", "4")),
         album_debounce_sec=int(os.getenv("ALBUM_DEBOUNCE_SEC", "2")),
+        album_max_buffered=int(os.getenv("ALBUM_MAX_BUFFERED", "500")),
+        delivery_workers=int(os.getenv("DELIVERY_WORKERS", "4")),
+        delivery_queue_size=int(os.getenv("DELIVERY_QUEUE_SIZE", "1000")),
+        delivery_stats_sec=int(os.getenv("DELIVERY_STATS_SEC", "60")),
+        outbox_dir=os.getenv("OUTBOX_DIR", "./data/outbox"),
+        outbox_fsync_ms=int(os.getenv("OUTBOX_FSYNC_MS", "50")),
+        outbox_segment_mb=int(os.getenv("OUTBOX_SEGMENT_MB", "16")),
     )
 
     os.makedirs(config.media_dir, exist_ok=True)
@@ -0,0 +1,217 @@
+"""Webhook delivery: the bounded worker queue and the per-message send step."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .config import Config
+from .janitor import get_janitor
+from .media import (
+    download_all_for_messages,
+    download_previews_for_messages,
+    media_metadata,
+    stream_media_for_message,
+)
+from .media_cache import get_cache
+from .metrics import current_channel
+from .parallel_download import get_parallel_downloader
+from .sender import enqueue_to_n8n, send_batch_to_n8n, send_stream_to_n8n, submit_to_n8n
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class DeliveryQueue:
+    """Run delivery jobs on a fixed pool of workers.
+
+    Every chat is pinned to one worker so its messages are delivered in the
+    order they were queued, while different chats are delivered concurrently.
+    Each worker owns a bounded queue; :meth:`put` waits while the target queue
+    is full, which pushes backpressure back to the Telethon handlers.
+    """
+
+    def __init__(self, workers: int, maxsize: int, stats_interval: float = 0) -> None:
+        self.workers = max(1, workers)
+        self.maxsize = max(self.workers, maxsize)
+        per_worker = self.maxsize // self.workers
+        self._queues: List[asyncio.Queue] = [
+            asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)
+        ]
+        self._busy = [False] * self.workers
+        self._busy_seconds = [0.0] * self.workers
+        self._stats_interval = stats_interval
+        self._stats_since = time.monotonic()
+        self._tasks: List[asyncio.Task] = []
+        self.delivered = 0
+        self.failed = 0
+        self.blocked_puts = 0
+
+    def start(self) -> None:
+        """Spawn worker tasks (and the stats reporter) on the running loop."""
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker(i)) for i in range(self.workers)]
+        if self._stats_interval > 0:
+            self._tasks.append(loop.create_task(self._report()))
+
+    def _slot(self, chat: str) -> int:
+        return zlib.crc32(chat.encode("utf-8")) % self.workers
+
+    async def put(self, chat: str, job: Job) -> None:
+        """Queue ``job`` for ``chat``, waiting while the worker queue is full."""
+        queue = self._queues[self._slot(chat)]
+        if queue.full():
+            self.blocked_puts += 1
+            logger.debug("delivery queue for %s is full, waiting", chat)
+        await queue.put(job)
+
+    async def _worker(self, index: int) -> None:
+        queue = self._queues[index]
+        while True:
+            job = await queue.get()
+            self._busy[index] = True
+            started = time.monotonic()
+            try:
+                await job()
+                self.delivered += 1
+            except Exception as exc:  # pragma: no cover - best effort
+                self.failed += 1
+                logger.exception("delivery job failed: %s", exc)
+            finally:
+                self._busy_seconds[index] += time.monotonic() - started
+                self._busy[index] = False
+                queue.task_done()
+
+    def stats(self) -> Dict[str, float]:
+        """Return queue depth and worker utilisation since the last call."""
+        now = time.monotonic()
+        elapsed = max(now - self._stats_since, 1e-9)
+        utilisation = sum(self._busy_seconds) / (elapsed * self.workers)
+        self._busy_seconds = [0.0] * self.workers
+        self._stats_since = now
+        return {
+            "depth": sum(q.qsize() for q in self._queues),
+            "max_depth": self.maxsize,
+            "busy_workers": sum(self._busy),
+            "workers": self.workers,
+            "utilisation": min(utilisation, 1.0),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "blocked_puts": self.blocked_puts,
+        }
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self._stats_interval)
+            s = self.stats()
+            logger.info(
+                "delivery queue depth=%s/%s busy=%s/%s utilisation=%.0f%% "
+                "delivered=%s failed=%s blocked=%s",
+                s["depth"],
+                s["max_depth"],
+                s["busy_workers"],
+                s["workers"],
+                s["utilisation"] * 100,
+                s["delivered"],
+                s["failed"],
+                s["blocked_puts"],
+            )
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """Wait for queued jobs to finish (up to ``timeout``) and stop workers."""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(q.join() for q in self._queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("delivery queue closed with %s job(s) pending", self.stats()["depth"])
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def wants_files(config: Config, payload: Dict) -> bool:
+    """Return ``True`` when ``payload`` is delivered together with its media."""
+    return (
+        config.media_download
+        and payload["has_media"]
+        and config.media_send_mode in ("multipart", "stream", "preview")
+    )
+
+
+def is_batched(config: Config, payload: Dict) -> bool:
+    """Return ``True`` when ``payload`` is posted in a webhook batch."""
+    return config.webhook_batch_size > 1 and not wants_files(config, payload)
+
+
+async def deliver_later(config: Config, payload: Dict) -> asyncio.Future:
+    """Add a batched ``payload`` to the next batch without waiting for it.
+
+    The returned future resolves to the same ``bool`` :func:`deliver` returns.
+    """
+    current_channel.set(payload.get("group", ""))
+    return await enqueue_to_n8n(payload, config)
+
+
+async def deliver(client, config: Config, payload: Dict, messages: List) -> bool:
+    """Attach the media of ``messages`` (if enabled) and post ``payload``."""
+    current_channel.set(payload.get("group", ""))
+    if not wants_files(config, payload):
+        return await submit_to_n8n(payload, config)
+    if config.media_send_mode == "stream":
+        streams = []
+        for m in messages:
+            streams.extend(
+                stream_media_for_message(
+                    client,
+                    m,
+                    config.media_max_mb,
+                    config.media_stream_chunk_kb * 1024,
+                    config.media_stream_buffer_chunks,
+                )
+            )
+        payload["media_count"] = len(streams)
+        return await send_stream_to_n8n(payload, streams, config)
+    if config.media_send_mode == "preview":
+        media_messages = [m for m in messages if m.media]
+        metadata = (media_metadata(m) for m in media_messages)
+        payload["media_meta"] = [meta for meta in metadata if meta is not None]
+        payload["media_count"] = len(media_messages)
+        file_items = await download_previews_for_messages(
+            client,
+            media_messages,
+            config.media_dir,
+            config.media_preview_min_px,
+            config.media_concurrency,
+        )
+        return await _send_files(config, payload, file_items)
+    file_items = await download_all_for_messages(
+        client,
+        messages,
+        config.media_dir,
+        config.media_max_mb,
+        config.media_concurrency,
+        get_cache(config),
+        get_parallel_downloader(config),
+    )
+    payload["media_count"] = len(file_items)
+    return await _send_files(config, payload, file_items)
+
+
+async def _send_files(config: Config, payload: Dict, file_items: List) -> bool:
+    paths = [item[0] for item in file_items]
+    janitor = get_janitor(config)
+    janitor.track(paths)
+    cache = get_cache(config)
+    ok = False
+    try:
+        ok = await send_batch_to_n8n(payload, file_items, config)
+    finally:
+        janitor.release(paths, delivered=ok)
+        if cache:
+            cache.release(paths)
+    return ok
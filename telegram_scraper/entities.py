@@ -0,0 +1,132 @@
+"""Persistent map of monitored chats: peer id -> username and title.
+
+Handlers need the username (or title) of the chat a message came from.
+Instead of awaiting ``event.get_chat()`` for every message, the configured
+channels are resolved once and kept in a JSON file, so a restart does not
+repeat hundreds of ``get_entity`` calls. Entries are refreshed when Telegram
+reports a change of the channel.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from telethon import events, types, utils
+
+from .client import ClientPool
+
+logger = logging.getLogger(__name__)
+
+
+class ChatDirectory:
+    """Peer id to ``{"channel", "username", "title"}`` map backed by a file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._chats: Dict[str, Dict[str, Optional[str]]] = {}
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                self._chats = json.load(fh)
+        except FileNotFoundError:
+            self._chats = {}
+        except json.JSONDecodeError:
+            logger.warning("chat cache %s is corrupt, resolving chats again", self.path)
+            self._chats = {}
+
+    def save(self) -> None:
+        """Atomically write the map to disk."""
+        directory = Path(self.path).parent
+        directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".chats-", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(self._chats, fh)
+        os.replace(tmp_path, self.path)
+
+    def name(self, peer_id: int) -> Optional[str]:
+        """Return the username (or title) used in payloads for ``peer_id``."""
+        entry = self._chats.get(str(peer_id))
+        if entry is None:
+            return None
+        return (entry.get("username") or entry.get("title") or "").lstrip("@")
+
+    def channel(self, peer_id: int) -> Optional[str]:
+        """Return the configured channel name of ``peer_id``, without ``@``."""
+        entry = self._chats.get(str(peer_id))
+        return entry.get("channel") if entry else None
+
+    def targets(self, channels: List[str]) -> List:
+        """Return ``channels`` as peer ids where known, else as ``@username``."""
+        ids = {e.get("channel"): int(pid) for pid, e in self._chats.items()}
+        return [ids.get(c.lower(), f"@{c}") for c in channels]
+
+    def remember(self, entity, channel: Optional[str] = None) -> str:
+        """Store ``entity`` and return its payload name."""
+        peer_id = str(utils.get_peer_id(entity))
+        old = self._chats.get(peer_id, {})
+        entry = {
+            "channel": channel or old.get("channel") or getattr(entity, "username", None),
+            "username": getattr(entity, "username", None),
+            "title": getattr(entity, "title", None),
+        }
+        if entry["channel"]:
+            entry["channel"] = entry["channel"].lower()
+        if entry != old:
+            self._chats[peer_id] = entry
+            self.save()
+        return self.name(int(peer_id)) or ""
+
+    async def resolve(self, pool: ClientPool, channels: List[str]) -> None:
+        """Resolve configured ``channels`` that are not in the map yet.
+
+        Handlers and catch-up pick sessions by peer id, so the channel is also
+        resolved on the session owning its peer id; access hashes belong to
+        the account that resolved them.
+        """
+        known = {e.get("channel") for e in self._chats.values()}
+        missing = [c for c in channels if c.lower() not in known]
+        for channel in missing:
+            try:
+                entity = await pool.run_owned(channel, lambda c, ch=channel: c.get_entity(ch))
+                peer_id = str(utils.get_peer_id(entity))
+                if pool.owner(peer_id) != pool.owner(channel):
+                    await pool.run_owned(peer_id, lambda c, ch=channel: c.get_entity(ch))
+            except ValueError as exc:
+                logger.warning("cannot resolve channel %s: %s", channel, exc)
+                continue
+            self.remember(entity, channel)
+        logger.info(
+            "chat cache: %s channel(s) cached, %s resolved", len(channels) - len(missing), len(missing)
+        )
+
+    async def refresh(self, pool: ClientPool, peer_id: int) -> None:
+        """Fetch ``peer_id`` again after Telegram reported a change."""
+        if str(peer_id) not in self._chats:
+            return
+        real_id, peer_type = utils.resolve_id(peer_id)
+        entity = await pool.run_owned(str(peer_id), lambda c: c.get_entity(peer_type(real_id)))
+        self.remember(entity)
+        logger.info("refreshed chat %s: %s", peer_id, self.name(peer_id))
+
+    def register(self, pool: ClientPool) -> None:
+        """Keep the map current from channel update events on ``pool``."""
+        for session, client in pool.clients.items():
+
+            async def on_update(update, session=session) -> None:
+                if not isinstance(update, types.UpdateChannel):
+                    return
+                peer_id = utils.get_peer_id(types.PeerChannel(update.channel_id))
+                if pool.owner(str(peer_id)) == session:
+                    await self.refresh(pool, peer_id)
+
+            async def on_action(event, session=session) -> None:
+                if event.new_title and pool.owner(str(event.chat_id)) == session:
+                    await self.refresh(pool, event.chat_id)
+
+            client.add_event_handler(on_update, events.Raw(types.UpdateChannel))
+            client.add_event_handler(on_action, events.ChatAction())
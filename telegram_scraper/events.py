@@ -2,22 +2,38 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
 import time
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Set
 
 from telethon import events
+from telethon.errors import FloodWaitError
 
+from .client import ClientPool
 from .config import Config
-from .media import download_all_for_message
-from .sender import send_batch_to_n8n, send_to_n8n
-from .state import load_state, save_state
-from .utils import format_reaction, sanitize_text
+from .delivery import DeliveryQueue, deliver, deliver_later, is_batched, wants_files
+from .entities import ChatDirectory
+from .janitor import close_janitor, get_janitor
+from .media import close_downloads
+from .media_cache import close_cache
+from .metrics import ALBUM_BUFFERED, HANDLER_SECONDS, current_channel, record_delivery_delay
+from .outbox import Outbox
+from .record import build_payload
+from .sender import flush_batches
+from .state import Checkpointer, open_state
 
 logger = logging.getLogger(__name__)
 
 
+# Telegram never groups more than this many messages into one album.
+ALBUM_MAX_ITEMS = 10
+# Flushed albums whose part ids are remembered to drop duplicate parts.
+ALBUM_RECENT = 1024
+
+
 @dataclass
 class AlbumBuffer:
     """Buffer for collecting album messages until debounce expires."""
@@ -25,133 +41,324 @@ class AlbumBuffer:
     chat: str
     messages: List
     last_update: float = field(default_factory=time.time)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+class AlbumScheduler:
+    """Collect album parts per ``grouped_id`` and flush each on its deadline.
 
+    Every album has its own ``loop.call_later`` timer that is pushed back by
+    ``debounce`` seconds whenever a part arrives. An album is flushed early
+    once it holds :data:`ALBUM_MAX_ITEMS` parts, and the oldest albums are
+    flushed early when more than ``max_buffered`` messages are waiting.
+    Flushed albums are processed as independent tasks. The part ids of the
+    last :data:`ALBUM_RECENT` flushed albums are remembered, so a part seen
+    again (by both catch-up and the live handler) after its album was flushed
+    is dropped instead of being delivered a second time.
+    """
 
-pending_albums: Dict[int, AlbumBuffer] = {}
+    def __init__(
+        self,
+        debounce: float,
+        max_buffered: int,
+        on_flush: Callable[[AlbumBuffer], Awaitable[None]],
+    ) -> None:
+        self.debounce = debounce
+        self.max_buffered = max(ALBUM_MAX_ITEMS, max_buffered)
+        self.on_flush = on_flush
+        self.pending: Dict[int, AlbumBuffer] = {}
+        self.buffered = 0
+        self._tasks: Set[asyncio.Task] = set()
+        # grouped_id -> ids of the parts already flushed, oldest album first
+        self._flushed: "OrderedDict[int, Set[int]]" = OrderedDict()
 
+    def add(self, grouped_id: int, chat: str, msg) -> None:
+        loop = asyncio.get_running_loop()
+        flushed = self._flushed.get(grouped_id)
+        if flushed is not None and msg.id in flushed:
+            return
+        buf = self.pending.get(grouped_id)
+        if buf is None:
+            buf = self.pending[grouped_id] = AlbumBuffer(chat=chat, messages=[])
+        elif any(m.id == msg.id for m in buf.messages):
+            # Seen by both catch-up and the live handler.
+            return
+        buf.messages.append(msg)
+        buf.last_update = time.time()
+        self.buffered += 1
+        if buf.timer is not None:
+            buf.timer.cancel()
+        if len(buf.messages) >= ALBUM_MAX_ITEMS:
+            self.flush(grouped_id)
+        else:
+            buf.timer = loop.call_later(self.debounce, self.flush, grouped_id)
+        while self.buffered > self.max_buffered and self.pending:
+            self.flush(next(iter(self.pending)))
+
+    def flush(self, grouped_id: int) -> None:
+        buf = self.pending.pop(grouped_id, None)
+        if buf is None:
+            return
+        if buf.timer is not None:
+            buf.timer.cancel()
+        self.buffered -= len(buf.messages)
+        buf.messages.sort(key=lambda m: m.id)
+        self._flushed.setdefault(grouped_id, set()).update(m.id for m in buf.messages)
+        self._flushed.move_to_end(grouped_id)
+        while len(self._flushed) > ALBUM_RECENT:
+            self._flushed.popitem(last=False)
+        task = asyncio.get_running_loop().create_task(self.on_flush(buf))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        """Flush every buffered album and wait for processing to finish."""
+        for grouped_id in list(self.pending):
+            self.flush(grouped_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+@dataclass
+class Pipeline:
+    """Long-lived delivery components started by :func:`register_handlers`."""
 
-def register_handlers(client, config: Config) -> None:
-    """Register new message handler on the given client."""
-    state: Dict[str, int] = load_state(config.state_file)
-    target_chats = [f"@{c}" for c in config.channels]
-    async def flush_albums() -> None:
-        while True:
-            now = time.time()
-            to_flush = [
-                gid for gid, buf in pending_albums.items()
-                if now - buf.last_update >= config.album_debounce_sec
-            ]
-            for gid in to_flush:
-                buf = pending_albums.pop(gid)
-                await _process_album(buf)
-            await asyncio.sleep(1)
+    albums: AlbumScheduler
+    delivery: DeliveryQueue
+    outbox: Outbox
+    state: Checkpointer
+    catchup: Optional[asyncio.Task] = None
+
+    async def close(self, timeout: Optional[float] = None) -> None:
+        """Drain deliveries, flush outbox/state/media cache and stop the janitor."""
+        if self.catchup is not None:
+            self.catchup.cancel()
+            await asyncio.gather(self.catchup, return_exceptions=True)
+        await self.albums.close()
+        await self.delivery.close(timeout)
+        # Batched deliveries are acked once their batch is answered.
+        await flush_batches()
+        await self.outbox.close()
+        await self.state.close()
+        await close_janitor()
+        close_cache()
+        close_downloads()
+
+
+def register_handlers(pool: ClientPool, config: Config, chats: ChatDirectory) -> Pipeline:
+    """Register new message handlers on every session of ``pool``.
+
+    Each session listens to all channels but only handles the channels it
+    owns on the pool's hash ring, so a session that is in FloodWait is
+    replaced by the next one without resubscribing. Chat names come from
+    ``chats``, which is kept current from channel update events. Returns the
+    :class:`Pipeline` that performs media downloads and webhook delivery so
+    the caller can drain it on shutdown.
+    """
+    client = pool.media_client()
+    state = open_state(config)
+    state.load()
+    state.start()
+    target_chats = chats.targets(config.channels)
+    delivery = DeliveryQueue(
+        config.delivery_workers,
+        config.delivery_queue_size,
+        config.delivery_stats_sec,
+    )
+    delivery.start()
+    outbox = Outbox(
+        config.outbox_dir,
+        config.outbox_segment_mb * 1024 * 1024,
+        config.outbox_fsync_ms / 1000,
+    )
+    unacked = outbox.open()
+    outbox.start()
+    get_janitor(config).start()
+
+    def _peer(peer_id: int):
+        """Return ``@channel`` for ``peer_id`` when it is configured, else the id.
+
+        By name, so a session that never saw the peer id can resolve it.
+        """
+        channel = chats.channel(peer_id)
+        return f"@{channel}" if channel else peer_id
+
+    async def _enqueue(chat: str, payload: Dict, messages: List) -> None:
+        """Record the delivery in the outbox, then queue it."""
+        entry_id = await outbox.append(
+            {
+                "chat": chat,
+                "peer_id": messages[0].chat_id,
+                "message_ids": [m.id for m in messages],
+                "payload": payload,
+            }
+        )
+        await delivery.put(chat, lambda: _run(entry_id, payload, messages))
+
+    def _settle(entry_id: int, payload: Dict, ok: bool) -> None:
+        if ok:
+            outbox.ack(entry_id)
+            record_delivery_delay(payload)
+        else:
+            logger.warning(
+                "delivery of %s failed, kept in outbox for replay",
+                payload.get("message_id"),
+            )
+
+    async def _run(entry_id: int, payload: Dict, messages: List) -> None:
+        if is_batched(config, payload):
+            # Don't hold the worker until the batch is sent, so it can keep
+            # feeding the batch; the entry is acked when the batch answers.
+            future = await deliver_later(config, payload)
+            future.add_done_callback(
+                lambda f: _settle(entry_id, payload, not f.cancelled() and f.result())
+            )
+            return
+        _settle(entry_id, payload, await deliver(client, config, payload, messages))
+
+    async def _replay(record: Dict) -> None:
+        payload = record["payload"]
+        messages: List = []
+        if wants_files(config, payload):
+            ids = record["message_ids"]
+            peer_id = record.get("peer_id")
+            if peer_id is None:
+                # Written before the peer id was recorded.
+                fetched = await client.get_messages(record["chat"], ids=ids)
+            else:
+                fetched = await pool.run_owned(
+                    str(peer_id), lambda c: c.get_messages(_peer(peer_id), ids=ids)
+                )
+            messages = [m for m in fetched if m is not None]
+        await _run(record["id"], payload, messages)
+
+    async def replay_outbox() -> None:
+        for record in unacked:
+            await delivery.put(record["chat"], lambda r=record: _replay(r))
 
     async def _process_album(buf: AlbumBuffer) -> None:
         messages = buf.messages
-        first = messages[0]
-        author_id: Optional[int] = None
-        if getattr(first, "from_id", None) and hasattr(first.from_id, "user_id"):
-            author_id = first.from_id.user_id  # type: ignore[assignment]
-
-        payload = {
-            "group": buf.chat,
-            "author_id": author_id,
-            "content": sanitize_text(first.message),
-            "date": first.date.strftime("%Y-%m-%d %H:%M:%S"),
-            "message_id": first.id,
-            "author": first.post_author,
-            "views": first.views,
-            "reactions": " ".join(
-                format_reaction(r) for r in getattr(first.reactions, "results", [])
-            ),
-            "shares": first.forwards,
-            "media": True,
-            "url": f"https://t.me/{buf.chat}/{first.id}",
-            "comments_list": [],
-            "album_group_id": getattr(first, "grouped_id", None),
-            "has_media": True,
-            "media_count": 0,
-        }
-
-        if config.media_download and config.media_send_mode == "multipart":
-            file_items = []
-            for m in messages:
-                file_items.extend(
-                    await download_all_for_message(
-                        client, m, config.media_dir, config.media_max_mb
-                    )
-                )
-            payload["media_count"] = len(file_items)
-            send_batch_to_n8n(payload, file_items, config)
-        else:
-            payload["media_count"] = len(messages)
-            send_to_n8n(payload, config)
+        payload = build_payload(buf.chat, messages)
+        await _enqueue(buf.chat, payload, messages)
+        state.mark(buf.chat, max(m.id for m in messages))
 
-    client.loop.create_task(flush_albums())
+    albums = AlbumScheduler(
+        config.album_debounce_sec, config.album_max_buffered, _process_album
+    )
 
-    @client.on(events.NewMessage(chats=target_chats))
-    async def handler(event) -> None:  # type: ignore[override]
-        chat = await event.get_chat()
-        chat_username = getattr(chat, "username", None) or getattr(chat, "title", "")
-        chat_username = chat_username.lstrip("@")
-        last_id = state.get(chat_username)
-        if last_id and event.message.id <= last_id:
+    def _album_sizes() -> Dict:
+        sizes: Dict = {}
+        for buf in albums.pending.values():
+            sizes[(buf.chat,)] = sizes.get((buf.chat,), 0) + len(buf.messages)
+        return sizes
+
+    ALBUM_BUFFERED.collect = _album_sizes
+    asyncio.get_running_loop().create_task(replay_outbox())
+
+    async def _chat_name(event, key: str) -> str:
+        name = chats.name(event.chat_id)
+        if name is not None:
+            return name
+
+        async def fetch(session):
+            if session is event.client:
+                return await event.get_chat()
+            return await session.get_entity(event.chat_id)
+
+        return chats.remember(await pool.run_owned(key, fetch))
+
+    # chat -> live messages held back while the chat is being caught up
+    catching_up: Dict[str, List] = {}
+
+    async def handler(session: str, event) -> None:
+        key = str(event.chat_id)
+        if pool.owner(key) != session:
             return
+        started = time.monotonic()
+        chat_username = await _chat_name(event, key)
+        current_channel.set(chat_username)
+        if chat_username in catching_up:
+            catching_up[chat_username].append(event.message)
+        else:
+            await _process(chat_username, event.message)
+        HANDLER_SECONDS.observe(time.monotonic() - started, channel=chat_username)
 
-        msg = event.message
-        state[chat_username] = msg.id
-        save_state(config.state_file, state)
+    async def _process(chat_username: str, msg) -> None:
+        last_id = state.get(chat_username)
+        if last_id and msg.id <= last_id:
+            return
 
         grouped_id = getattr(msg, "grouped_id", None)
         if grouped_id:
-            buf = pending_albums.get(grouped_id)
-            if buf:
-                buf.messages.append(msg)
-                buf.last_update = time.time()
-            else:
-                pending_albums[grouped_id] = AlbumBuffer(
-                    chat=chat_username, messages=[msg]
-                )
+            albums.add(grouped_id, chat_username, msg)
             return
 
-        author_id: Optional[int] = None
-        if getattr(msg, "from_id", None) and hasattr(msg.from_id, "user_id"):
-            author_id = msg.from_id.user_id  # type: ignore[assignment]
-
-        has_media = bool(msg.media)
-        payload = {
-            "group": chat_username,
-            "author_id": author_id,
-            "content": sanitize_text(msg.message),
-            "date": msg.date.strftime("%Y-%m-%d %H:%M:%S"),
-            "message_id": msg.id,
-            "author": msg.post_author,
-            "views": msg.views,
-            "reactions": " ".join(
-                format_reaction(r) for r in getattr(msg.reactions, "results", [])
-            ),
-            "shares": msg.forwards,
-            "media": has_media,
-            "url": f"https://t.me/{chat_username}/{msg.id}",
-            "comments_list": [],
-            "album_group_id": None,
-            "has_media": has_media,
-            "media_count": 0,
-        }
-
-        if (
-            config.media_download
-            and has_media
-            and config.media_send_mode == "multipart"
-        ):
-            file_items = await download_all_for_message(
-                client, msg, config.media_dir, config.media_max_mb
+        payload = build_payload(chat_username, [msg])
+        await _enqueue(chat_username, payload, [msg])
+        state.mark(chat_username, msg.id)
+
+    async def _catch_up_chat(peer_id: int, chat_username: str, slots: asyncio.Semaphore) -> None:
+        key = str(peer_id)
+        target = _peer(peer_id)
+        fetched = 0
+        try:
+            async with slots:
+                while True:
+                    session = pool.owner(key)
+                    try:
+                        async for msg in pool.clients[session].iter_messages(
+                            target,
+                            min_id=state.get(chat_username) or 0,
+                            reverse=True,
+                            wait_time=config.catchup_wait_sec,
+                        ):
+                            await _process(chat_username, msg)
+                            fetched += 1
+                        break
+                    except FloodWaitError as exc:
+                        # Resume from the last marked id on the next owner.
+                        pool.mark_flood(session, exc.seconds)
+        except Exception as exc:  # pragma: no cover - best effort
+            logger.warning("catch-up of %s failed: %s", chat_username, exc)
+        finally:
+            held = catching_up[chat_username]
+            held.sort(key=lambda m: m.id)
+            while held:
+                await _process(chat_username, held.pop(0))
+            del catching_up[chat_username]
+        if fetched:
+            logger.info("caught up %s message(s) in %s", fetched, chat_username)
+
+    async def catch_up() -> None:
+        """Backfill messages posted while the service was down."""
+        slots = asyncio.Semaphore(config.catchup_concurrency)
+        await asyncio.gather(
+            *(
+                _catch_up_chat(peer_id, name, slots)
+                for peer_id, name in pending_catchup.items()
             )
-            payload["media_count"] = len(file_items)
-            send_batch_to_n8n(payload, file_items, config)
-        else:
-            if has_media:
-                payload["media_count"] = 1
-            send_to_n8n(payload, config)
+        )
+        logger.info("catch-up finished for %s channel(s)", len(pending_catchup))
+
+    # Only chats with a stored position are caught up; new chats start live.
+    pending_catchup: Dict[int, str] = {}
+    if config.catchup_concurrency > 0:
+        for target in target_chats:
+            name = chats.name(target) if isinstance(target, int) else None
+            if name and state.get(name):
+                pending_catchup[target] = name
+                catching_up[name] = []
+
+    chats.register(pool)
+    for session, session_client in pool.clients.items():
+        session_client.add_event_handler(
+            functools.partial(handler, session), events.NewMessage(chats=target_chats)
+        )
 
-    logger.info("subscribed to %s", ",".join(config.channels))
+    logger.info(
+        "subscribed to %s with %s session(s)", ",".join(config.channels), len(pool.clients)
+    )
+    catchup = asyncio.get_running_loop().create_task(catch_up()) if pending_catchup else None
+    return Pipeline(
+        albums=albums, delivery=delivery, outbox=outbox, state=state, catchup=catchup
+    )
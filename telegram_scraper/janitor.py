@@ -0,0 +1,168 @@
+"""Retention and garbage collection for ``MEDIA_DIR``."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Set, Tuple
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+_janitor: Optional["MediaJanitor"] = None
+
+
+class MediaJanitor:
+    """Keep ``MEDIA_DIR`` within a byte quota and a maximum file age.
+
+    The directory is scanned once at startup; afterwards new files are
+    reported through :meth:`track`, so the index stays ordered oldest-first
+    and every cleanup cycle only looks at the head of it. Files that are still
+    waiting to be sent are never evicted, and with ``delete_after_send`` (the
+    default) a file is removed as soon as its delivery is confirmed. Files
+    moved into the media cache leave ``MEDIA_DIR``; the cache bounds them with
+    its own LRU quota.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        quota_bytes: int,
+        max_age: float,
+        interval: float,
+        delete_after_send: bool,
+    ) -> None:
+        self.directory = os.path.abspath(directory)
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.delete_after_send = delete_after_send
+        # path -> (mtime, size), oldest first
+        self._files: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._in_use: Set[str] = set()
+        self.total_bytes = 0
+        self.reclaimed_bytes = 0
+        self._task: Optional[asyncio.Task] = None
+        self._scan()
+
+    def _scan(self) -> None:
+        found = []
+        for root, _dirs, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, path, st.st_size))
+        for mtime, path, size in sorted(found):
+            self._files[path] = (mtime, size)
+            self.total_bytes += size
+
+    def _owns(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(self.directory + os.sep)
+
+    def track(self, paths: Iterable[str]) -> None:
+        """Register freshly downloaded files that are about to be sent."""
+        for path in paths:
+            if not self._owns(path):
+                continue
+            path = os.path.abspath(path)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            old = self._files.pop(path, None)
+            if old:
+                self.total_bytes -= old[1]
+            self._files[path] = (time.time(), size)
+            self.total_bytes += size
+            self._in_use.add(path)
+
+    def release(self, paths: Iterable[str], delivered: bool) -> None:
+        """Mark files as no longer in use, deleting them if delivered."""
+        for path in paths:
+            path = os.path.abspath(path)
+            self._in_use.discard(path)
+            if delivered and self.delete_after_send and path in self._files:
+                self._delete(path)
+
+    def _delete(self, path: str) -> None:
+        _mtime, size = self._files.pop(path)
+        self.total_bytes -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as exc:
+            logger.warning("error deleting media %s: %s", path, exc)
+            return
+        self.reclaimed_bytes += size
+
+    def collect(self) -> int:
+        """Evict expired files and enforce the quota; return bytes freed."""
+        before = self.reclaimed_bytes
+        cutoff = time.time() - self.max_age if self.max_age > 0 else None
+        remaining = self.total_bytes
+        victims = []
+        for path, (mtime, size) in self._files.items():
+            over_quota = 0 < self.quota_bytes < remaining
+            expired = cutoff is not None and mtime < cutoff
+            if not (over_quota or expired):
+                break
+            if path in self._in_use:
+                continue
+            victims.append(path)
+            remaining -= size
+        for path in victims:
+            self._delete(path)
+        return self.reclaimed_bytes - before
+
+    def start(self) -> None:
+        """Start the periodic cleanup task on the running loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            freed = self.collect()
+            if freed:
+                logger.info(
+                    "media janitor freed %s bytes (total reclaimed %s, %s bytes kept)",
+                    freed,
+                    self.reclaimed_bytes,
+                    self.total_bytes,
+                )
+            await asyncio.sleep(self.interval)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def get_janitor(config: Config) -> MediaJanitor:
+    """Return the process-wide janitor for ``config.media_dir``."""
+    global _janitor
+    if _janitor is None:
+        _janitor = MediaJanitor(
+            config.media_dir,
+            config.media_retention_mb * 1024 * 1024,
+            config.media_retention_hours * 3600,
+            config.media_janitor_sec,
+            config.media_delete_after_send,
+        )
+    return _janitor
+
+
+async def close_janitor() -> None:
+    """Stop the cleanup task."""
+    global _janitor
+    if _janitor is not None:
+        await _janitor.close()
+        logger.info("media janitor reclaimed %s bytes", _janitor.reclaimed_bytes)
+    _janitor = None
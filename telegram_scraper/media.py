@@ -1,20 +1,115 @@
 """Helpers for downloading media files from Telegram messages."""
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
-from typing import AsyncIterator, Dict, List, Optional, Tuple
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 
+from telethon.tl import types
 from telethon.tl.custom.message import Message
 
+from .media_cache import MediaCache, media_key
+from .metrics import MEDIA_DOWNLOAD_BYTES, MEDIA_DOWNLOAD_SECONDS, current_channel
+from .parallel_download import ParallelDownloader
+
 logger = logging.getLogger(__name__)
 
+# (path, mimetype, upload file name) of one downloaded file.
+FileItem = Tuple[str, Optional[str], str]
+
+# Shared by every concurrent download in the process; sized on first use.
+_download_slots: Optional[asyncio.Semaphore] = None
+
+
+def _slots(limit: int) -> asyncio.Semaphore:
+    global _download_slots
+    if _download_slots is None:
+        _download_slots = asyncio.Semaphore(max(1, limit))
+    return _download_slots
+
+
+def close_downloads() -> None:
+    """Drop the download semaphore; it is bound to the loop that used it."""
+    global _download_slots
+    _download_slots = None
+
+
+def peer_dir(download_dir: str, msg: Message) -> str:
+    """Return (and create) the subdirectory of ``download_dir`` for the chat of ``msg``.
+
+    Message ids are only unique within a chat, so files named after them are
+    kept apart per chat.
+    """
+    chat_id = getattr(msg, "chat_id", None)
+    if chat_id is None:
+        return download_dir
+    directory = os.path.join(download_dir, str(chat_id))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+async def _fetch(
+    client, msg: Message, download_dir: str, parallel: Optional[ParallelDownloader]
+) -> Optional[str]:
+    """Download ``msg`` with the parallel engine if it applies, else sequentially."""
+    started = time.monotonic()
+    if parallel is not None and parallel.applies_to(msg):
+        name = getattr(msg.file, "name", None) or f"document{msg.file.ext or ''}"
+        target = os.path.join(peer_dir(download_dir, msg), f"{msg.id}_{name}")
+        try:
+            # A pooled client picks the session and refetches the message.
+            run = getattr(client, "run_download", None)
+            if run is not None:
+                path = await run(msg, lambda c, m: parallel.download(c, m, target))
+            else:
+                path = await parallel.download(client, msg, target)
+            _record_download(path, started)
+            return path
+        except Exception as exc:
+            logger.warning("parallel download failed, falling back: %s", exc)
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+
+    started = time.monotonic()
+    path = await client.download_media(msg, download_dir)
+    if path and os.path.exists(path):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        logger.debug(
+            "downloaded %s (%.1f MB) in %.1fs, %.2f MB/s",
+            os.path.basename(path),
+            size_mb,
+            elapsed,
+            size_mb / elapsed,
+        )
+        _record_download(path, started)
+    return path
+
+
+def _record_download(path: str, started: float) -> None:
+    channel = current_channel.get()
+    MEDIA_DOWNLOAD_BYTES.inc(os.path.getsize(path), channel=channel)
+    MEDIA_DOWNLOAD_SECONDS.observe(time.monotonic() - started, channel=channel)
+
 
 async def download_one(
-    client, msg: Message, download_dir: str, max_mb: int
+    client,
+    msg: Message,
+    download_dir: str,
+    max_mb: int,
+    cache: Optional[MediaCache] = None,
+    parallel: Optional[ParallelDownloader] = None,
 ) -> Optional[Dict]:
     """Download a single media item from ``msg`` into ``download_dir``.
 
+    With a ``cache`` the file is looked up by its Telegram id first and, on a
+    miss, moved into the cache after downloading. Large documents are fetched
+    with ``parallel`` when given.
+
     Returns metadata about the downloaded file or ``None`` if the file is
     missing or exceeds the size limit.
     """
@@ -26,25 +121,42 @@ async def download_one(
         logger.warning("media larger than %sMB, skipping", max_mb)
         return None
 
-    try:
-        path = await client.download_media(msg, download_dir)
-    except Exception as exc:  # pragma: no cover - best effort
-        logger.warning("error downloading media: %s", exc)
-        return None
+    key = media_key(msg) if cache else None
+    path = cache.lookup(key) if cache else None
+    filename = cache.name(key) if path and cache else None
+    if path is None:
+        try:
+            path = await _fetch(client, msg, download_dir, parallel)
+        except Exception as exc:  # pragma: no cover - best effort
+            logger.warning("error downloading media: %s", exc)
+            return None
 
-    if not path or not os.path.exists(path):
-        return None
+        if not path or not os.path.exists(path):
+            return None
+
+        filesize = os.path.getsize(path)
+        if filesize > max_mb * 1024 * 1024:
+            logger.warning("downloaded media larger than %sMB, skipping", max_mb)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        filename = os.path.basename(path)
+        if cache:
+            try:
+                path = await cache.store(key, path)
+            except Exception as exc:  # pragma: no cover - best effort
+                # Send the uncached download instead.
+                logger.warning("error caching media %s: %s", filename, exc)
+                if not os.path.exists(path):
+                    return None
 
     filesize = os.path.getsize(path)
-    if filesize > max_mb * 1024 * 1024:
-        logger.warning("downloaded media larger than %sMB, skipping", max_mb)
-        try:
-            os.remove(path)
-        except OSError:
-            pass
-        return None
 
-    filename = os.path.basename(path)
+    # Cached files are named by content hash; upload under the original name.
+    filename = filename or os.path.basename(path)
     mimetype = getattr(file, "mime_type", None) if file else None
     return {
         "file_path": path,
@@ -55,19 +167,203 @@ async def download_one(
 
 
 async def iter_media_items(
-    client, msg: Message, download_dir: str, max_mb: int
+    client,
+    msg: Message,
+    download_dir: str,
+    max_mb: int,
+    cache: Optional[MediaCache] = None,
+    parallel: Optional[ParallelDownloader] = None,
 ) -> AsyncIterator[Dict]:
     """Yield metadata dictionaries for each media item in ``msg``."""
-    meta = await download_one(client, msg, download_dir, max_mb)
+    meta = await download_one(client, msg, download_dir, max_mb, cache, parallel)
     if meta:
         yield meta
 
 
 async def download_all_for_message(
-    client, msg: Message, download_dir: str, max_mb: int
-) -> List[Tuple[str, str | None]]:
-    """Download all media for ``msg`` and return list of path/mimetype pairs."""
-    results: List[Tuple[str, str | None]] = []
-    async for meta in iter_media_items(client, msg, download_dir, max_mb):
-        results.append((meta["file_path"], meta.get("mimetype")))
+    client,
+    msg: Message,
+    download_dir: str,
+    max_mb: int,
+    cache: Optional[MediaCache] = None,
+    parallel: Optional[ParallelDownloader] = None,
+) -> List[FileItem]:
+    """Download all media for ``msg`` and return its :data:`FileItem` list."""
+    results: List[FileItem] = []
+    async for meta in iter_media_items(
+        client, msg, download_dir, max_mb, cache, parallel
+    ):
+        results.append((meta["file_path"], meta.get("mimetype"), meta["filename"]))
     return results
+
+
+async def download_all_for_messages(
+    client,
+    messages: List[Message],
+    download_dir: str,
+    max_mb: int,
+    concurrency: int,
+    cache: Optional[MediaCache] = None,
+    parallel: Optional[ParallelDownloader] = None,
+) -> List[FileItem]:
+    """Download media for all ``messages`` concurrently.
+
+    Downloads share a process-wide semaphore of ``concurrency`` slots. The
+    result keeps the order of ``messages`` regardless of completion order.
+    """
+    slots = _slots(concurrency)
+
+    async def one(msg: Message) -> List[FileItem]:
+        async with slots:
+            return await download_all_for_message(
+                client, msg, download_dir, max_mb, cache, parallel
+            )
+
+    per_message = await asyncio.gather(*(one(m) for m in messages))
+    return [item for items in per_message for item in items]
+
+
+def media_metadata(msg: Message) -> Optional[Dict]:
+    """Describe the full-size media of ``msg`` without downloading it.
+
+    Returns ``None`` for media that is neither a photo nor a document (geo,
+    polls, contacts, web pages and so on), which has no file to describe.
+    """
+    if getattr(msg, "photo", None):
+        kind = "photo"
+    elif getattr(msg, "document", None):
+        kind = "document"
+    else:
+        return None
+    file = getattr(msg, "file", None)
+    return {
+        "message_id": msg.id,
+        "type": kind,
+        "filename": getattr(file, "name", None),
+        "mimetype": getattr(file, "mime_type", None),
+        "size": getattr(file, "size", None),
+        "width": getattr(file, "width", None),
+        "height": getattr(file, "height", None),
+        "duration": getattr(file, "duration", None),
+    }
+
+
+def pick_preview_size(sizes, min_px: int) -> Optional[str]:
+    """Return the type of the smallest size at least ``min_px`` on its long side.
+
+    Falls back to the largest available size when none is big enough. Inline
+    stripped/path sizes are ignored since they are not real images.
+    """
+    candidates = [
+        s
+        for s in sizes or []
+        if isinstance(s, (types.PhotoSize, types.PhotoCachedSize, types.PhotoSizeProgressive))
+    ]
+    if not candidates:
+        return None
+    suitable = [s for s in candidates if max(s.w, s.h) >= min_px]
+    if suitable:
+        return min(suitable, key=lambda s: s.w * s.h).type
+    return max(candidates, key=lambda s: s.w * s.h).type
+
+
+async def download_preview(
+    client, msg: Message, download_dir: str, min_px: int
+) -> Optional[FileItem]:
+    """Download a preview of ``msg`` (photo size or video/document thumbnail)."""
+    if getattr(msg, "photo", None):
+        sizes = msg.photo.sizes
+    elif getattr(msg, "document", None):
+        sizes = msg.document.thumbs
+    else:
+        return None
+    thumb = pick_preview_size(sizes, min_px)
+    if thumb is None:
+        return None
+    target = os.path.join(peer_dir(download_dir, msg), f"{msg.id}_preview_{thumb}.jpg")
+    try:
+        path = await client.download_media(msg, target, thumb=thumb)
+    except Exception as exc:  # pragma: no cover - best effort
+        logger.warning("error downloading preview: %s", exc)
+        return None
+    if not path or not os.path.exists(path):
+        return None
+    return path, "image/jpeg", os.path.basename(path)
+
+
+async def download_previews_for_messages(
+    client, messages: List[Message], download_dir: str, min_px: int, concurrency: int
+) -> List[FileItem]:
+    """Download previews for ``messages`` concurrently, keeping their order."""
+    slots = _slots(concurrency)
+
+    async def one(msg: Message) -> Optional[FileItem]:
+        async with slots:
+            return await download_preview(client, msg, download_dir, min_px)
+
+    previews = await asyncio.gather(*(one(m) for m in messages))
+    return [p for p in previews if p]
+
+
+ChunkSource = Callable[[], AsyncIterator[bytes]]
+
+
+async def _buffered_chunks(
+    client, msg: Message, chunk_size: int, buffer_chunks: int
+) -> AsyncIterator[bytes]:
+    """Yield the media of ``msg`` chunk by chunk straight from Telegram.
+
+    A producer task downloads ahead into a queue of at most ``buffer_chunks``
+    chunks, so download and upload overlap while memory stays bounded.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, buffer_chunks))
+
+    async def produce() -> None:
+        channel = current_channel.get()
+        started = time.monotonic()
+        try:
+            async for chunk in client.iter_download(msg, chunk_size=chunk_size):
+                MEDIA_DOWNLOAD_BYTES.inc(len(chunk), channel=channel)
+                await queue.put(chunk)
+            await queue.put(None)
+            MEDIA_DOWNLOAD_SECONDS.observe(time.monotonic() - started, channel=channel)
+        except Exception as exc:
+            await queue.put(exc)
+
+    producer = asyncio.get_running_loop().create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
+
+def stream_media_for_message(
+    client, msg: Message, max_mb: int, chunk_size: int, buffer_chunks: int
+) -> List[Tuple[str, str | None, ChunkSource]]:
+    """Describe the media of ``msg`` as streams without downloading it.
+
+    Returns ``(filename, mimetype, source)`` triples where ``source()`` starts a
+    fresh chunked download each time it is called, so a failed upload can be
+    retried.
+    """
+    file = getattr(msg, "file", None)
+    if not msg.media or file is None:
+        return []
+    if (getattr(file, "size", 0) or 0) > max_mb * 1024 * 1024:
+        logger.warning("media larger than %sMB, skipping", max_mb)
+        return []
+    filename = getattr(file, "name", None) or f"{msg.id}{getattr(file, 'ext', '') or ''}"
+    mimetype = getattr(file, "mime_type", None)
+    return [
+        (
+            filename,
+            mimetype,
+            lambda: _buffered_chunks(client, msg, chunk_size, buffer_chunks),
+        )
+    ]
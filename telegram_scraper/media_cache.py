@@ -0,0 +1,229 @@
+"""Content-addressed cache for downloaded Telegram media.
+
+Files are stored once under their SHA-256 digest. An index maps Telegram
+media keys (photo/document id and access hash) to digests, so a forwarded or
+cross-posted file is only downloaded the first time it is seen. The original
+file name of every key is kept too, so uploads are named as before. The cache is
+bounded in bytes and evicts the least recently used files first, skipping
+files pinned by a delivery that is still using them; the index is kept in
+``index.json`` next to the files and survives restarts.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, Iterable, Optional
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+# Persist the index after this many changes even if nobody calls save().
+SAVE_EVERY = 20
+
+_cache: Optional["MediaCache"] = None
+
+
+def media_key(msg) -> Optional[str]:
+    """Return a stable cache key for the media of ``msg`` if it has one."""
+    for kind in ("photo", "document"):
+        obj = getattr(msg, kind, None)
+        media_id = getattr(obj, "id", None)
+        if media_id is not None:
+            return f"{kind}-{media_id}-{getattr(obj, 'access_hash', 0)}"
+    return None
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """Size-bounded LRU store of media files addressed by content hash."""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # digest -> {"file": name, "size": bytes, "atime": last use}
+        self._blobs: Dict[str, Dict] = {}
+        # media key -> digest
+        self._keys: Dict[str, str] = {}
+        # media key -> file name the download had before it was cached
+        self._names: Dict[str, str] = {}
+        # digest -> paths handed out by lookup/store and not yet released
+        self._pins: Dict[str, int] = {}
+        self._changes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(b["size"] for b in self._blobs.values())
+
+    def _load(self) -> None:
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE), "r", encoding="utf-8") as fh:
+                index = json.load(fh)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        blobs = index.get("blobs", {})
+        on_disk = {
+            name.split(".", 1)[0]: name
+            for name in os.listdir(self.directory)
+            if name != INDEX_FILE and not name.startswith(".")
+        }
+        for digest, name in on_disk.items():
+            entry = blobs.get(digest)
+            if entry is None:
+                path = os.path.join(self.directory, name)
+                entry = {
+                    "file": name,
+                    "size": os.path.getsize(path),
+                    "atime": os.path.getmtime(path),
+                }
+            self._blobs[digest] = entry
+        self._keys = {
+            key: digest
+            for key, digest in index.get("keys", {}).items()
+            if digest in self._blobs
+        }
+        self._names = {
+            key: name for key, name in index.get("names", {}).items() if key in self._keys
+        }
+        self._evict()
+
+    def save(self) -> None:
+        """Atomically write the index to disk."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".index-")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump({"blobs": self._blobs, "keys": self._keys, "names": self._names}, fh)
+        os.replace(tmp_path, os.path.join(self.directory, INDEX_FILE))
+        self._changes = 0
+
+    def _changed(self) -> None:
+        self._changes += 1
+        if self._changes >= SAVE_EVERY:
+            self.save()
+
+    def lookup(self, key: Optional[str]) -> Optional[str]:
+        """Return the cached path for ``key`` or ``None`` on a miss.
+
+        The returned file is pinned until it is passed to :meth:`release`.
+        """
+        digest = self._keys.get(key) if key else None
+        entry = self._blobs.get(digest) if digest else None
+        if entry is None:
+            self.misses += 1
+            return None
+        path = os.path.join(self.directory, entry["file"])
+        if not os.path.exists(path):
+            self._forget(digest)  # type: ignore[arg-type]
+            self.misses += 1
+            return None
+        entry["atime"] = time.time()
+        self.hits += 1
+        self._pins[digest] = self._pins.get(digest, 0) + 1  # type: ignore[index]
+        return path
+
+    def name(self, key: Optional[str]) -> Optional[str]:
+        """Return the original file name stored with ``key``, if known."""
+        return self._names.get(key) if key else None
+
+    async def store(self, key: Optional[str], path: str) -> str:
+        """Move the downloaded file at ``path`` into the cache.
+
+        Returns the cached path. If identical content is already cached the
+        new file is dropped and the existing copy is reused. The file name of
+        ``path`` is remembered for ``key`` and returned by :meth:`name`. Like
+        with :meth:`lookup`, the returned file is pinned until released.
+        """
+        name = os.path.basename(path)
+        digest = await asyncio.get_running_loop().run_in_executor(None, _sha256, path)
+        entry = self._blobs.get(digest)
+        if entry is not None and os.path.exists(os.path.join(self.directory, entry["file"])):
+            os.remove(path)
+        else:
+            ext = os.path.splitext(path)[1]
+            entry = {"file": f"{digest}{ext}", "size": os.path.getsize(path)}
+            os.replace(path, os.path.join(self.directory, entry["file"]))
+            self._blobs[digest] = entry
+        entry["atime"] = time.time()
+        if key:
+            self._keys[key] = digest
+            self._names[key] = name
+        self._pins[digest] = self._pins.get(digest, 0) + 1
+        self._evict()
+        self._changed()
+        return os.path.join(self.directory, entry["file"])
+
+    def release(self, paths: Iterable[str]) -> None:
+        """Unpin cached files once the delivery using them has finished.
+
+        Paths outside the cache are ignored, so a delivery can pass all of
+        its files.
+        """
+        directory = os.path.abspath(self.directory)
+        for path in paths:
+            if os.path.dirname(os.path.abspath(path)) != directory:
+                continue
+            digest = os.path.basename(path).split(".", 1)[0]
+            count = self._pins.get(digest, 0) - 1
+            if count > 0:
+                self._pins[digest] = count
+            else:
+                self._pins.pop(digest, None)
+        # Catch up on evictions the pins held back.
+        self._evict()
+
+    def _forget(self, digest: str) -> None:
+        self._blobs.pop(digest, None)
+        self._keys = {k: d for k, d in self._keys.items() if d != digest}
+        self._names = {k: n for k, n in self._names.items() if k in self._keys}
+
+    def _evict(self) -> None:
+        total = self.total_bytes
+        if total <= self.max_bytes:
+            return
+        for digest, entry in sorted(self._blobs.items(), key=lambda kv: kv[1]["atime"]):
+            if total <= self.max_bytes:
+                break
+            if digest in self._pins:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, entry["file"]))
+            except OSError:
+                pass
+            total -= entry["size"]
+            self._forget(digest)
+            logger.debug("evicted cached media %s", entry["file"])
+
+
+def get_cache(config: Config) -> Optional[MediaCache]:
+    """Return the process-wide media cache, or ``None`` if it is disabled."""
+    global _cache
+    if config.media_cache_mb <= 0:
+        return None
+    if _cache is None:
+        _cache = MediaCache(config.media_cache_dir, config.media_cache_mb * 1024 * 1024)
+    return _cache
+
+
+def close_cache() -> None:
+    """Persist the cache index."""
+    global _cache
+    if _cache is not None:
+        _cache.save()
+        logger.info("media cache hits=%s misses=%s", _cache.hits, _cache.misses)
+    _cache = None
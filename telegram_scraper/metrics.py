@@ -0,0 +1,219 @@
+"""Prometheus text-format metrics and the optional HTTP endpoint serving them.
+
+The metric types are deliberately small: counters, gauges and histograms
+with labels, rendered in the Prometheus exposition format. The channel a
+piece of work belongs to is kept in a context variable, so code deep in the
+media and sender modules can label samples without passing it around.
+"""
+from __future__ import annotations
+
+import abc
+import contextvars
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DELAY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+current_channel: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_channel", default=""
+)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[str]:
+        """Yield the sample lines of this metric."""
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Gauge(_Metric):
+    """Gauge whose values are read from ``collect`` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        collect: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        values = self.collect() if self.collect else {}
+        for key, value in values.items():
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # label values -> [bucket counts..., sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        row = self._values.get(key)
+        if row is None:
+            row = self._values[key] = [0] * len(self.buckets) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+        row[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        for key, row in self._values.items():
+            for bound, count in zip(self.buckets, row):
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {count}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(row[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {row[-2]}"
+
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text format."""
+    return "".join(m.render() for m in _registry)
+
+
+HANDLER_SECONDS = Histogram(
+    "tg_handler_seconds", "Time spent in the new message handler", ["channel"]
+)
+DELIVERY_DELAY_SECONDS = Histogram(
+    "tg_delivery_delay_seconds",
+    "Delay from the Telegram message date to the webhook acknowledgement",
+    ["channel"],
+    DELAY_BUCKETS,
+)
+MEDIA_DOWNLOAD_BYTES = Counter(
+    "tg_media_download_bytes_total", "Bytes of media downloaded from Telegram", ["channel"]
+)
+MEDIA_DOWNLOAD_SECONDS = Histogram(
+    "tg_media_download_seconds", "Duration of media downloads", ["channel"]
+)
+WEBHOOK_RESPONSES = Counter(
+    "tg_webhook_responses_total", "Webhook responses by status code", ["channel", "status"]
+)
+WEBHOOK_SECONDS = Histogram(
+    "tg_webhook_seconds", "Webhook request latency", ["channel"]
+)
+WEBHOOK_RETRIES = Counter(
+    "tg_webhook_retries_total", "Webhook requests that were retries", ["channel"]
+)
+STATE_FLUSH_SECONDS = Histogram(
+    "tg_state_flush_seconds", "Duration of state flushes (one flush covers many channels)"
+)
+# Filled in by events.register_handlers with the live album buffer.
+ALBUM_BUFFERED = Gauge(
+    "tg_album_buffered_messages", "Album parts waiting for their album to complete", ["channel"]
+)
+
+
+def record_webhook(
+    channels: Iterable[str], status: object, started: float, attempt: int
+) -> None:
+    """Record one webhook request made on behalf of ``channels``."""
+    elapsed = time.monotonic() - started
+    for channel in set(channels):
+        WEBHOOK_RESPONSES.inc(channel=channel, status=str(status))
+        WEBHOOK_SECONDS.observe(elapsed, channel=channel)
+        if attempt > 1:
+            WEBHOOK_RETRIES.inc(channel=channel)
+
+
+def record_delivery_delay(payload: Dict) -> None:
+    """Observe the age of ``payload``'s message at acknowledgement time."""
+    try:
+        sent = datetime.strptime(payload["date"], "%Y-%m-%d %H:%M:%S")
+    except (KeyError, TypeError, ValueError):
+        return
+    age = datetime.now(timezone.utc) - sent.replace(tzinfo=timezone.utc)
+    DELIVERY_DELAY_SECONDS.observe(age.total_seconds(), channel=payload.get("group", ""))
+
+
+async def _handle(_request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(config: Config) -> Optional[web.AppRunner]:
+    """Serve ``/metrics`` on ``METRICS_HOST:METRICS_PORT`` when enabled."""
+    if config.metrics_port <= 0:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, config.metrics_host, config.metrics_port).start()
+    logger.info("metrics on http://%s:%s/metrics", config.metrics_host, config.metrics_port)
+    return runner
@@ -0,0 +1,213 @@
+"""Durable write-ahead outbox for webhook deliveries.
+
+Every delivery is appended to a segment log before it is attempted and an
+acknowledgement record is appended once the webhook answered with a 2xx.
+Entries without an acknowledgement are replayed on the next start.
+
+The log is a directory of JSON-lines segment files named after the first id
+they contain. Writes are buffered and fsynced in batches every
+``fsync_interval`` seconds; :meth:`Outbox.append` resolves once its record is
+on disk. When the active segment grows past ``segment_bytes`` a new one is
+started and closed segments are compacted: fully acknowledged segments are
+deleted and mostly acknowledged ones have their live records copied forward.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from typing import IO, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Closed segments with fewer live records than this share are rewritten.
+COMPACT_LIVE_RATIO = 0.25
+
+
+class Outbox:
+    """Append-only segment log of pending webhook deliveries."""
+
+    def __init__(
+        self, directory: str, segment_bytes: int, fsync_interval: float
+    ) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self._next_id = 1
+        self._records: Dict[int, Dict] = {}
+        self._segment_of: Dict[int, int] = {}
+        self._segment_puts: Dict[int, int] = {}
+        self._segment_live: Dict[int, int] = {}
+        # segment -> {entry id: segment of its put} for acks of older puts
+        self._segment_acks: Dict[int, Dict[int, int]] = {}
+        self._active = 0
+        self._fh: Optional[IO[str]] = None
+        self._dirty = False
+        self._waiters: List[asyncio.Future] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:020d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(
+            int(name[:-4])
+            for name in os.listdir(self.directory)
+            if name.endswith(".log") and name[:-4].isdigit()
+        )
+
+    def open(self) -> List[Dict]:
+        """Read existing segments and return unacknowledged records by id."""
+        os.makedirs(self.directory, exist_ok=True)
+        acked = set()
+        put_segment: Dict[int, int] = {}
+        for segment in self._segments():
+            with open(self._path(segment), "r", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning("skipping torn outbox record in %s", segment)
+                        continue
+                    entry_id = record["id"]
+                    self._next_id = max(self._next_id, entry_id + 1)
+                    if record.get("op") == "ack":
+                        acked.add(entry_id)
+                        origin = put_segment.get(entry_id)
+                        if origin is not None and origin != segment:
+                            self._segment_acks.setdefault(segment, {})[entry_id] = origin
+                        continue
+                    put_segment[entry_id] = segment
+                    self._segment_puts[segment] = self._segment_puts.get(segment, 0) + 1
+                    self._records[entry_id] = record
+                    self._segment_of[entry_id] = segment
+        for entry_id in acked:
+            self._records.pop(entry_id, None)
+            self._segment_of.pop(entry_id, None)
+        for segment in self._segment_of.values():
+            self._segment_live[segment] = self._segment_live.get(segment, 0) + 1
+        self._roll()
+        pending = [self._records[i] for i in sorted(self._records)]
+        if pending:
+            logger.info("outbox has %s unacknowledged deliveries", len(pending))
+        return pending
+
+    def start(self) -> None:
+        """Start the batched fsync task on the running loop."""
+        self._task = asyncio.get_running_loop().create_task(self._flusher())
+
+    def _write(self, record: Dict) -> None:
+        assert self._fh is not None, "outbox is not open"
+        self._fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._dirty = True
+
+    async def append(self, record: Dict) -> int:
+        """Persist ``record`` and return its id once it has been fsynced."""
+        entry_id = self._next_id
+        self._next_id += 1
+        record = {"op": "put", "id": entry_id, **record}
+        self._write(record)
+        self._records[entry_id] = record
+        self._segment_of[entry_id] = self._active
+        self._segment_puts[self._active] += 1
+        self._segment_live[self._active] += 1
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        await waiter
+        return entry_id
+
+    def ack(self, entry_id: int) -> None:
+        """Mark ``entry_id`` as delivered; written with the next fsync batch."""
+        if self._records.pop(entry_id, None) is None:
+            return
+        segment = self._segment_of.pop(entry_id)
+        self._segment_live[segment] -= 1
+        if segment != self._active:
+            self._segment_acks.setdefault(self._active, {})[entry_id] = segment
+        self._write({"op": "ack", "id": entry_id})
+
+    @property
+    def pending(self) -> int:
+        """Number of records that have not been acknowledged yet."""
+        return len(self._records)
+
+    async def _sync(self) -> None:
+        waiters, self._waiters = self._waiters, []
+        self._dirty = False
+        assert self._fh is not None
+        self._fh.flush()
+        await asyncio.get_running_loop().run_in_executor(
+            None, os.fsync, self._fh.fileno()
+        )
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _flusher(self) -> None:
+        await self._compact()
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            if self._dirty:
+                await self._sync()
+            if self._fh is not None and self._fh.tell() >= self.segment_bytes:
+                self._roll()
+                await self._compact()
+
+    def _roll(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        self._active = self._next_id
+        self._segment_puts.setdefault(self._active, 0)
+        self._segment_live.setdefault(self._active, 0)
+        self._fh = open(self._path(self._active), "a", encoding="utf-8")
+
+    async def _compact(self) -> None:
+        """Drop acknowledged segments and move sparse ones forward.
+
+        Acks stored in a dropped segment whose puts live in a segment that is
+        kept are copied forward too, or those entries would be replayed.
+        """
+        moved: List[int] = []
+        segments = self._segments()
+        for segment in segments:
+            if segment == self._active:
+                continue
+            live = self._segment_live.get(segment, 0)
+            puts = self._segment_puts.get(segment, 0)
+            if live and puts and live / puts >= COMPACT_LIVE_RATIO:
+                continue
+            for entry_id, seg in list(self._segment_of.items()):
+                if seg == segment:
+                    self._write(self._records[entry_id])
+                    self._segment_of[entry_id] = self._active
+                    self._segment_puts[self._active] += 1
+                    self._segment_live[self._active] += 1
+            moved.append(segment)
+        for segment in moved:
+            for entry_id, origin in self._segment_acks.get(segment, {}).items():
+                if origin in segments and origin not in moved:
+                    self._write({"op": "ack", "id": entry_id})
+                    self._segment_acks.setdefault(self._active, {})[entry_id] = origin
+        if not moved:
+            return
+        if self._dirty:
+            await self._sync()
+        for segment in moved:
+            os.remove(self._path(segment))
+            self._segment_puts.pop(segment, None)
+            self._segment_live.pop(segment, None)
+            self._segment_acks.pop(segment, None)
+        logger.debug("outbox compacted %s segment(s)", len(moved))
+
+    async def close(self) -> None:
+        """Flush pending writes and stop the fsync task."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._fh is not None:
+            if self._dirty or self._waiters:
+                await self._sync()
+            self._fh.close()
+            self._fh = None
@@ -0,0 +1,126 @@
+"""Adaptive pacing for bulk exports.
+
+:class:`AdaptivePacer` replaces a fixed sleep between webhook posts. It
+limits both the number of deliveries in flight and the rate at which new
+ones start, and tunes both from what it observes: fast successful
+deliveries raise the limits additively. Latency well above the best seen so
+far halves the concurrency; errors and Telegram FloodWaits also double the
+interval between starts.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the latency and error moving averages.
+EWMA_ALPHA = 0.2
+# Latency above this multiple of the best average counts as congestion.
+LATENCY_SLACK = 2.0
+# Error rate (moving average) above which the pacer backs off.
+ERROR_THRESHOLD = 0.1
+# Successful deliveries needed before the concurrency limit grows by one.
+GROW_EVERY = 5
+
+
+class AdaptivePacer:
+    """AIMD controller for concurrency and start rate of deliveries."""
+
+    def __init__(
+        self, max_concurrency: int, max_rate: float, initial_delay: float = 1.0
+    ) -> None:
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.max_interval = max(initial_delay, self.min_interval, 1.0) * 8
+        self.interval = max(initial_delay, self.min_interval)
+        self.limit = 1
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.best_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self._next_start = 0.0
+        self._paused_until = 0.0
+        self._successes = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        """Wait for a free slot and for the next start time."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            now = time.monotonic()
+            start = max(now, self._next_start, self._paused_until)
+            self._next_start = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def release(self, latency: Optional[float], ok: bool) -> None:
+        """Return a slot and feed the outcome of the delivery back.
+
+        ``latency`` may be ``None`` for deliveries whose duration says little
+        about the webhook, such as those that include a media download.
+        """
+        async with self._cond:
+            self.in_flight -= 1
+            self._observe(latency, ok)
+            self._cond.notify_all()
+
+    def _observe(self, latency: Optional[float], ok: bool) -> None:
+        self.error_rate += EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok and latency is not None:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += EWMA_ALPHA * (latency - self.latency)
+            if self.best_latency is None or self.latency < self.best_latency:
+                self.best_latency = self.latency
+        congested = (
+            self.latency is not None
+            and self.best_latency is not None
+            and self.latency > self.best_latency * LATENCY_SLACK
+        )
+        if not ok and self.error_rate > ERROR_THRESHOLD:
+            self._back_off(slow_down=True)
+        elif congested:
+            if self.limit == 1:
+                # Slow even without concurrency: the webhook itself got slower.
+                self.best_latency = self.latency
+            self._back_off(slow_down=False)
+        elif ok:
+            self._successes += 1
+            self.interval = max(self.min_interval, self.interval * 0.9)
+            if self._successes >= GROW_EVERY and self.limit < self.max_concurrency:
+                self.limit += 1
+                self._successes = 0
+
+    def _back_off(self, slow_down: bool) -> None:
+        self.limit = max(1, self.limit // 2)
+        if slow_down:
+            self.interval = min(
+                self.max_interval, max(self.interval * 2, self.min_interval, 0.1)
+            )
+        self._successes = 0
+        # Forget the congested latency so recovery is judged afresh.
+        self.latency = self.best_latency
+        logger.debug(
+            "pacer backing off: limit=%s interval=%.2fs error_rate=%.2f",
+            self.limit,
+            self.interval,
+            self.error_rate,
+        )
+
+    def flood_wait(self, seconds: float) -> None:
+        """Pause every new start for ``seconds`` after a Telegram FloodWait."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._back_off(slow_down=True)
+        logger.warning("FloodWait of %ss, pausing export", seconds)
+
+    def describe(self) -> str:
+        return (
+            f"limit={self.limit}/{self.max_concurrency} "
+            f"interval={self.interval:.2f}s latency={self.latency or 0:.2f}s "
+            f"errors={self.error_rate:.0%}"
+        )
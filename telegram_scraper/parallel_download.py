@@ -0,0 +1,146 @@
+"""Parallel ranged downloads for large Telegram documents.
+
+``client.download_media`` fetches a file as one sequential stream of
+``upload.getFile`` requests over a single connection. For large videos the
+:class:`ParallelDownloader` instead opens several MTProto connections to the
+datacenter that stores the file, requests disjoint byte ranges concurrently
+and writes every part at its offset into a preallocated file.
+
+This relies on Telethon internals (``_get_dc``, ``_connection`` and
+``_init_request``) the same way Telethon's own exported senders do. Any
+failure makes the caller fall back to the regular download path.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import List, Optional
+
+from telethon import utils
+from telethon.errors import FloodWaitError
+from telethon.network import MTProtoSender
+from telethon.tl import functions, types
+from telethon.tl.alltlobjects import LAYER
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# upload.getFile limits must divide 1 MiB and offsets must be multiples of them.
+PART_SIZE = 512 * 1024
+
+
+class ParallelDownloader:
+    """Download large documents as concurrent byte ranges."""
+
+    def __init__(self, connections: int, min_bytes: int, part_size: int = PART_SIZE) -> None:
+        self.connections = connections
+        self.min_bytes = min_bytes
+        self.part_size = part_size
+
+    def applies_to(self, msg) -> bool:
+        """Return ``True`` if ``msg`` holds a document worth splitting."""
+        if self.connections < 2 or not isinstance(getattr(msg, "document", None), types.Document):
+            return False
+        return (msg.document.size or 0) >= self.min_bytes
+
+    async def _create_senders(self, client, dc_id: int, count: int) -> List[MTProtoSender]:
+        dc = await client._get_dc(dc_id)
+        home = dc_id == client.session.dc_id
+        auth_key = client.session.auth_key if home else None
+        senders: List[MTProtoSender] = []
+        try:
+            for _ in range(count):
+                sender = MTProtoSender(auth_key, loggers=client._log)
+                await sender.connect(
+                    client._connection(
+                        dc.ip_address,
+                        dc.port,
+                        dc.id,
+                        loggers=client._log,
+                        proxy=client._proxy,
+                        local_addr=client._local_addr,
+                    )
+                )
+                senders.append(sender)
+                if auth_key is None:
+                    auth = await client(functions.auth.ExportAuthorizationRequest(dc_id))
+                    client._init_request.query = functions.auth.ImportAuthorizationRequest(
+                        id=auth.id, bytes=auth.bytes
+                    )
+                    await sender.send(
+                        functions.InvokeWithLayerRequest(LAYER, client._init_request)
+                    )
+                    auth_key = sender.auth_key
+        except BaseException:
+            await asyncio.gather(*(s.disconnect() for s in senders), return_exceptions=True)
+            raise
+        return senders
+
+    async def download(self, client, msg, path: str) -> str:
+        """Download the document of ``msg`` into ``path`` and return it."""
+        document = msg.document
+        size = document.size
+        dc_id, location = utils.get_input_location(document)
+        part_count = math.ceil(size / self.part_size)
+        started = time.monotonic()
+
+        with open(path, "wb") as fh:
+            fh.truncate(size)
+        fd = os.open(path, os.O_WRONLY)
+        senders = await self._create_senders(
+            client, dc_id, min(self.connections, part_count)
+        )
+        next_part = 0
+        loop = asyncio.get_running_loop()
+        # These senders bypass client._call, so go through the limiter here.
+        limiter = getattr(client, "limiter", None)
+
+        async def worker(sender: MTProtoSender) -> None:
+            nonlocal next_part
+            while next_part < part_count:
+                index = next_part
+                next_part += 1
+                offset = index * self.part_size
+                request = functions.upload.GetFileRequest(
+                    location, offset=offset, limit=self.part_size, precise=False
+                )
+                bucket = await limiter.acquire(request) if limiter else None
+                try:
+                    result = await sender.send(request)
+                except FloodWaitError as exc:
+                    if bucket:
+                        bucket.flood(exc.seconds)
+                    raise
+                if not isinstance(result, types.upload.File):
+                    raise RuntimeError(f"unsupported getFile result {type(result).__name__}")
+                await loop.run_in_executor(None, os.pwrite, fd, result.bytes, offset)
+
+        try:
+            await asyncio.gather(*(worker(s) for s in senders))
+        finally:
+            os.close(fd)
+            await asyncio.gather(*(s.disconnect() for s in senders), return_exceptions=True)
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        logger.info(
+            "downloaded %s (%.1f MB) in %.1fs, %.2f MB/s over %s connection(s)",
+            os.path.basename(path),
+            size / 1024 / 1024,
+            elapsed,
+            size / 1024 / 1024 / elapsed,
+            len(senders),
+        )
+        return path
+
+
+def get_parallel_downloader(config: Config) -> Optional[ParallelDownloader]:
+    """Return a downloader for ``config`` or ``None`` when disabled."""
+    if config.media_parallel_connections < 2:
+        return None
+    return ParallelDownloader(
+        config.media_parallel_connections, config.media_parallel_min_mb * 1024 * 1024
+    )
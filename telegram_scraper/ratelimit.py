@@ -0,0 +1,155 @@
+"""FloodWait-aware token buckets for Telegram API calls.
+
+Every session owns a :class:`FloodLimiter` with one token bucket per method
+class (history listing, comment replies, entity resolution, file downloads
+and everything else). Calls take a token before they are sent, so bursts are
+smoothed out before Telegram answers with a FloodWait. When a FloodWait does
+arrive the bucket of that class is paused for the wait and its rate is cut
+according to the duration; successful calls slowly raise the rate again up
+to the configured ceiling.
+
+A rate of ``0`` leaves a class ungated: its calls are only paused while a
+FloodWait on that class lasts. File downloads are ungated by default, since
+each ``GetFileRequest`` moves at most 128 KiB and any token rate low enough
+to matter would cap download throughput.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Requests per second and burst size per method class.
+DEFAULT_RATES: Dict[str, float] = {
+    "history": 3.0,
+    "replies": 10.0,
+    "resolve": 0.5,
+    "download": 0.0,
+    "default": 5.0,
+}
+BURST_SECONDS = 2.0
+# Rates never drop below this after FloodWaits.
+MIN_RATE = 0.02
+# Multiplicative recovery per successful call, up to the ceiling.
+RECOVERY = 1.02
+
+_CLASSES = {
+    "GetHistoryRequest": "history",
+    "GetRepliesRequest": "replies",
+    "SearchRequest": "history",
+    "GetMessagesRequest": "history",
+    "GetDiscussionMessageRequest": "history",
+    "ResolveUsernameRequest": "resolve",
+    "GetChannelsRequest": "resolve",
+    "GetFullChannelRequest": "resolve",
+    "GetUsersRequest": "resolve",
+    "GetChatsRequest": "resolve",
+    "GetFileRequest": "download",
+    "GetCdnFileRequest": "download",
+    "GetWebFileRequest": "download",
+}
+
+
+def method_class(request) -> str:
+    """Return the rate class of a Telethon request object."""
+    inner = getattr(request, "query", None)
+    if inner is not None and type(request).__name__.startswith("InvokeWith"):
+        return method_class(inner)
+    return _CLASSES.get(type(request).__name__, "default")
+
+
+class TokenBucket:
+    """Token bucket whose rate adapts to FloodWaits; a rate of 0 never gates."""
+
+    def __init__(self, name: str, rate: float) -> None:
+        self.name = name
+        self.ceiling = rate
+        self.rate = rate
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def gated(self) -> bool:
+        return self.ceiling > 0
+
+    @property
+    def capacity(self) -> float:
+        return max(1.0, self.rate * BURST_SECONDS)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if not self.gated:
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return
+        # The lock keeps waiters in FIFO order.
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def succeeded(self) -> None:
+        if self.rate < self.ceiling:
+            self.rate = min(self.ceiling, self.rate * RECOVERY)
+
+    def flood(self, seconds: float) -> None:
+        """Pause for ``seconds`` and lower the rate to match the penalty."""
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        if not self.gated:
+            logger.warning("FloodWait %ss on %s calls", seconds, self.name)
+            return
+        # A wait of N seconds means roughly a burst's worth of calls was too
+        # many for the last N seconds.
+        self.rate = max(MIN_RATE, min(self.rate / 2, self.capacity / max(seconds, 1)))
+        self.tokens = 0
+        self._updated = now
+        logger.warning(
+            "FloodWait %ss on %s calls, rate lowered to %.2f/s", seconds, self.name, self.rate
+        )
+
+
+class FloodLimiter:
+    """Per-session set of token buckets keyed by method class."""
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None) -> None:
+        merged = dict(DEFAULT_RATES, **(rates or {}))
+        self.buckets = {name: TokenBucket(name, rate) for name, rate in merged.items()}
+
+    def bucket(self, request) -> TokenBucket:
+        return self.buckets.get(method_class(request), self.buckets["default"])
+
+    async def acquire(self, request) -> TokenBucket:
+        bucket = self.bucket(request)
+        await bucket.acquire()
+        return bucket
+
+
+def parse_rates(value: str) -> Dict[str, float]:
+    """Parse ``history=3,resolve=0.5`` into a rate override map (0 = ungated)."""
+    rates: Dict[str, float] = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_RATES:
+            raise ValueError(f"Unknown rate class {name!r} in TG_RATE_LIMITS")
+        rates[name] = float(rate)
+    return rates
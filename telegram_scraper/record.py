@@ -0,0 +1,104 @@
+"""The webhook payload of a message and its JSON encoding.
+
+:func:`build_payload` is the one place a Telethon ``Message`` (or the parts
+of an album) is turned into the payload posted to n8n; the live handler,
+album flushes and the bulk thread export all go through it. The payload is a
+plain dict because the outbox persists it and delivery adds media fields to
+it. :func:`encode_json` serialises payloads straight to ``bytes`` for every
+request body and multipart ``payload`` field, using ``orjson`` (a
+requirement) or ``msgspec`` when installed and the standard library
+otherwise.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from .utils import format_reaction, sanitize_text
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - optional speed-up
+    msgspec = None  # type: ignore[assignment]
+
+
+# One shared encoder: json.dumps builds a new one per call for non-default options.
+_STDLIB_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def _stdlib_encode(obj: Any) -> bytes:
+    # ASCII output (escaped non-ASCII) makes the final encode a plain copy.
+    return _STDLIB_ENCODER.encode(obj).encode("ascii")
+
+
+# encode_json(obj) -> bytes: UTF-8 JSON, the fastest available encoder.
+if orjson is not None:
+    encode_json: Callable[[Any], bytes] = orjson.dumps
+    JSON_ENCODER = "orjson"
+elif msgspec is not None:
+    encode_json = msgspec.json.Encoder().encode
+    JSON_ENCODER = "msgspec"
+else:
+    encode_json = _stdlib_encode
+    JSON_ENCODER = "json"
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def format_date(date) -> str:
+    """Format a message date as ``YYYY-MM-DD HH:MM:SS``."""
+    if date is None:
+        return ""
+    # isoformat is implemented in C and several times cheaper than strftime.
+    return date.isoformat(" ", "seconds")[:19]
+
+
+def _author_id(msg) -> Optional[int]:
+    from_id = getattr(msg, "from_id", None)
+    return getattr(from_id, "user_id", None) if from_id else None
+
+
+def _reactions(msg) -> str:
+    results = getattr(getattr(msg, "reactions", None), "results", None)
+    if not results:
+        return ""
+    return " ".join(format_reaction(r) for r in results)
+
+
+def build_payload(chat: str, messages: Sequence, **extra) -> Dict[str, Any]:
+    """Return the payload of ``messages`` (one message or an album) in ``chat``.
+
+    The first message carries the text and counters; ``extra`` adds optional
+    fields such as ``thread_message_id``.
+    """
+    first = messages[0]
+    group = chat.lstrip("@")
+    if len(messages) == 1:
+        has_media = bool(first.media)
+    else:
+        has_media = any(bool(m.media) for m in messages)
+    payload = {
+        "group": group,
+        "author_id": _author_id(first),
+        "content": sanitize_text(first.message),
+        "date": format_date(first.date),
+        "message_id": first.id,
+        "author": getattr(first, "post_author", None),
+        "views": getattr(first, "views", None),
+        "reactions": _reactions(first),
+        "shares": getattr(first, "forwards", None),
+        "media": has_media,
+        "url": f"https://t.me/{group}/{first.id}",
+        "comments_list": [],
+        "album_group_id": getattr(first, "grouped_id", None),
+        "has_media": has_media,
+        "media_count": len(messages) if has_media else 0,
+    }
+    if extra:
+        payload.update(extra)
+    return payload
@@ -3,25 +3,67 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import signal
 import time
+from typing import Optional
 
-from .client import get_client
-from .config import load_config
+from .client import ClientPool
+from .config import Config, load_config
+from .entities import ChatDirectory
 from .events import register_handlers
+from .metrics import start_metrics_server
+from .sender import close_session
+from .supervisor import supervise
 from .utils import setup_logging
 
 
-async def _runner() -> None:
-    config = load_config()
-    setup_logging(config.log_level)
-    client = get_client(config.api_id, config.api_hash)
-    await client.start()
-    register_handlers(client, config)
+async def _runner(config: Optional[Config] = None) -> None:
+    if config is None:
+        config = load_config()
+        setup_logging(config.log_level)
+    metrics = await start_metrics_server(config)
+    pool = ClientPool.from_config(config)
+    await pool.start()
+    chats = ChatDirectory(config.chat_cache_file)
+    chats.load()
+    await chats.resolve(pool, config.channels)
+    pipeline = register_handlers(pool, config, chats)
     logging.getLogger(__name__).info("listening on %s", ",".join(config.channels))
-    await client.run_until_disconnected()
+    try:
+        await pool.run_until_disconnected()
+    finally:
+        await pipeline.close(timeout=config.http_timeout)
+        await close_session()
+        await pool.disconnect()
+        if metrics is not None:
+            await metrics.cleanup()
+
+
+async def _shard_runner(config: Config) -> None:
+    # The supervisor stops workers with SIGTERM; cancel so the pipeline drains.
+    task = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)  # type: ignore[union-attr]
+    try:
+        await _runner(config)
+    except asyncio.CancelledError:
+        pass
+
+
+def run_shard(config: Config, name: str) -> None:
+    """Run one shard in the current process until it disconnects or is stopped."""
+    setup_logging(config.log_level, tag=name)
+    try:
+        asyncio.run(_shard_runner(config))
+    except KeyboardInterrupt:
+        pass
 
 
 def main() -> None:
+    config = load_config()
+    if config.shards > 1:
+        setup_logging(config.log_level, tag="supervisor")
+        supervise(config)
+        return
     while True:
         try:
             asyncio.run(_runner())
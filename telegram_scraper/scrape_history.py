@@ -0,0 +1,480 @@
+"""Historical export of whole channels to Parquet files.
+
+This is the bulk scraper of the notebook as a command line tool. Messages
+are read oldest first and streamed into a :class:`RollingParquetWriter`,
+which writes fixed-size row groups and starts a new file every
+``--file-rows`` rows, so memory use does not grow with the export. A file
+is written as ``.part`` and renamed once it is complete; the last message id
+of every channel in it is then checkpointed, and a later run with the same
+``--name`` resumes from there.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from telethon.errors import FloodWaitError
+
+from .client import get_client
+from .config import Config, load_config
+from .record import format_date
+from .state import Checkpointer, open_thread_state
+from .utils import format_reaction, setup_logging
+
+log = logging.getLogger(__name__)
+
+# Same columns as the notebook export, so the combine/summary scripts work on both.
+SCHEMA = pa.schema(
+    [
+        ("Type", pa.string()),
+        ("Group", pa.string()),
+        ("Author ID", pa.int64()),
+        ("Content", pa.string()),
+        ("Date", pa.string()),
+        ("Message ID", pa.int64()),
+        ("Author", pa.string()),
+        ("Views", pa.int64()),
+        ("Reactions", pa.string()),
+        ("Shares", pa.int64()),
+        ("Media", pa.string()),
+        ("Url", pa.string()),
+        ("Comments List", pa.string()),
+    ]
+)
+
+# Characters that are not valid in XML break the Excel exports downstream.
+_INVALID_XML = re.compile("[^\u0009\u000A\u000D\u0020-\uD7FF\uE000-\uFFFD\U00010000-\U0010FFFF]")
+
+
+def clean_text(text: Optional[str]) -> str:
+    return _INVALID_XML.sub("", text or "")
+
+
+def _reactions(msg) -> str:
+    results = getattr(getattr(msg, "reactions", None), "results", None)
+    return " ".join(format_reaction(r) for r in results) if results else ""
+
+
+def comment_row(group: str, msg, comment) -> Dict:
+    return {
+        "Type": "comment",
+        "Comment Group": group,
+        "Comment Author ID": comment.sender_id,
+        "Comment Content": (comment.text or "").replace("'", '"'),
+        "Comment Date": format_date(comment.date),
+        "Comment Message ID": comment.id,
+        "Comment Author": comment.post_author,
+        "Comment Views": comment.views,
+        "Comment Reactions": _reactions(comment),
+        "Comment Shares": comment.forwards,
+        "Comment Media": "True" if comment.media else "False",
+        "Comment Url": f"https://t.me/{group.lstrip('@')}/{msg.id}?comment={comment.id}",
+    }
+
+
+def message_row(group: str, msg, comments: List[Dict]) -> Dict:
+    return {
+        "Type": "text",
+        "Group": group,
+        "Author ID": msg.sender_id,
+        "Content": clean_text(msg.text),
+        "Date": format_date(msg.date),
+        "Message ID": msg.id,
+        "Author": msg.post_author,
+        "Views": msg.views,
+        "Reactions": _reactions(msg),
+        "Shares": msg.forwards,
+        "Media": "True" if msg.media else "False",
+        "Url": f"https://t.me/{group.lstrip('@')}/{msg.id}",
+        "Comments List": clean_text(json.dumps(comments)),
+    }
+
+
+class RollingParquetWriter:
+    """Append rows to Parquet files in fixed-size row groups.
+
+    At most ``row_group_size`` rows are held in memory. A file is closed and
+    renamed from ``.part`` after ``file_rows`` rows (rounded up to whole row
+    groups); ``on_file`` is then called with the ``{chat: last id}`` of the
+    rows it contains.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        name: str,
+        row_group_size: int,
+        file_rows: int,
+        on_file=None,
+    ) -> None:
+        self.directory = directory
+        self.name = name
+        self.row_group_size = max(1, row_group_size)
+        self.file_rows = max(self.row_group_size, file_rows)
+        self.on_file = on_file
+        # Rows written to row groups so far.
+        self.rows = 0
+        self.files: List[str] = []
+        self._buffer: List[Dict] = []
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._path = ""
+        self._file_rows = 0
+        self._last_ids: Dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+        for stale in glob.glob(os.path.join(directory, f"{glob.escape(name)}_*.parquet.part")):
+            log.warning(f"removing incomplete file {stale}")
+            os.remove(stale)
+        done = glob.glob(os.path.join(directory, f"{glob.escape(name)}_*.parquet"))
+        # Continue numbering after the files of earlier runs.
+        self._index = 1 + max((int(p[-13:-8]) for p in done if p[-13:-8].isdigit()), default=-1)
+
+    @property
+    def count(self) -> int:
+        """Rows accepted so far, including those not written yet."""
+        return self.rows + len(self._buffer)
+
+    async def write(self, chat: str, row: Dict) -> None:
+        self._buffer.append(row)
+        self._last_ids[chat] = max(self._last_ids.get(chat, 0), row["Message ID"])
+        if len(self._buffer) >= self.row_group_size:
+            await self._flush_group()
+
+    async def _flush_group(self) -> None:
+        if not self._buffer:
+            return
+        table = pa.Table.from_pylist(self._buffer, schema=SCHEMA)
+        self._buffer = []
+        if self._writer is None:
+            self._path = os.path.join(self.directory, f"{self.name}_{self._index:05}.parquet.part")
+            self._writer = pq.ParquetWriter(self._path, SCHEMA)
+            self._index += 1
+        await asyncio.to_thread(self._writer.write_table, table)
+        self._file_rows += table.num_rows
+        self.rows += table.num_rows
+        if self._file_rows >= self.file_rows:
+            await self._roll()
+
+    async def _roll(self) -> None:
+        if self._writer is None:
+            return
+        await asyncio.to_thread(self._writer.close)
+        final = self._path[: -len(".part")]
+        os.replace(self._path, final)
+        self.files.append(final)
+        log.info(f"wrote {final} ({self._file_rows} rows)")
+        last_ids, self._last_ids = self._last_ids, {}
+        self._writer = None
+        self._file_rows = 0
+        if self.on_file is not None:
+            await self.on_file(last_ids)
+
+    async def close(self) -> None:
+        """Write buffered rows and finish the current file."""
+        await self._flush_group()
+        await self._roll()
+
+
+def checkpoint_key(chat: str, name: str) -> str:
+    return f"history:{chat.lstrip('@').lower()}:{name}"
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+def reply_count(msg) -> Optional[int]:
+    """Return the number of comments under ``msg``, ``None`` if it has no thread."""
+    replies = getattr(msg, "replies", None)
+    return getattr(replies, "replies", None) if replies is not None else None
+
+
+async def fetch_comments(client, chat: str, msg) -> List[Dict]:
+    """Return the comment rows of ``msg``, newest first as before.
+
+    Comments are read oldest first; the read stops at the reply count seen when ``msg`` was listed, which
+    saves the request for the empty page after the last comment. If Telegram
+    reports more comments by then, the rest are read without a limit. The
+    client's limiter paces the requests, so Telethon's own wait between
+    chunks is off.
+    """
+    comments: List[Dict] = []
+    expected = reply_count(msg)
+    while True:
+        remaining = expected - len(comments) if expected else 0
+        try:
+            # Oldest first from the last comment read, so a retry continues
+            # where the previous attempt stopped.
+            replies = client.iter_messages(
+                chat,
+                limit=remaining if remaining > 0 else None,
+                reply_to=msg.id,
+                reverse=True,
+                min_id=comments[-1]["Comment Message ID"] if comments else 0,
+                wait_time=0,
+            )
+            async for comment in replies:
+                comments.append(comment_row(chat, msg, comment))
+        except FloodWaitError as exc:
+            # Longer than TG_FLOOD_SLEEP_MAX.
+            log.warning(f"FloodWait of {exc.seconds}s while reading comments of {chat}/{msg.id}")
+            await asyncio.sleep(exc.seconds)
+            continue
+        except Exception as exc:  # pragma: no cover - best effort
+            log.warning(f"error fetching comments of {chat}/{msg.id}: {exc}")
+            return []
+        total = getattr(replies, "total", None)
+        if remaining > 0 and total and total > len(comments):
+            # Comments posted since the message was listed.
+            expected = 0
+            continue
+        comments.reverse()
+        return comments
+
+
+class HistoryExport:
+    """Read channel history and write it out with comments attached.
+
+    Reading messages and fetching their comments are separate stages: every
+    message with comments gets a fetch task (at most ``comment_concurrency``
+    run at once) and is queued together with it. The writer takes messages
+    off the queue in order and waits only for the comments of the message at
+    its head, so listing keeps going until the queue is full. Messages whose
+    reply count is zero, or that have no comment thread at all, are never
+    fetched. A channel that cannot be resolved or fails while it is read is
+    logged, listed in ``failed`` and skipped.
+    """
+
+    def __init__(
+        self,
+        client,
+        state: Checkpointer,
+        writer: RollingParquetWriter,
+        name: str,
+        since: Optional[datetime],
+        until: Optional[datetime],
+        search: Optional[str],
+        limit: int,
+        comment_concurrency: int,
+    ) -> None:
+        self.client = client
+        self.state = state
+        self.writer = writer
+        self.name = name
+        self.since = since
+        self.until = until
+        self.search = search
+        self.limit = limit
+        self.comments = comment_concurrency > 0
+        self._comment_slots = asyncio.Semaphore(max(1, comment_concurrency))
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(16, comment_concurrency * 8))
+        self.read = 0
+        self.comment_fetches = 0
+        self.failed: List[str] = []
+
+    async def run(self, channels: List[str]) -> None:
+        reader = asyncio.create_task(self._read_all(channels))
+        writer = asyncio.create_task(self._write_all())
+        try:
+            await asyncio.gather(reader, writer)
+        finally:
+            reader.cancel()
+            writer.cancel()
+            await asyncio.gather(reader, writer, return_exceptions=True)
+            # Comment fetches still queued after a failure.
+            while not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not None and item[2] is not None:
+                    item[2].cancel()
+
+    async def _read_all(self, channels: List[str]) -> None:
+        try:
+            for chat in channels:
+                if self.limit and self.read >= self.limit:
+                    break
+                try:
+                    await self._read(chat)
+                except Exception as exc:
+                    # Rows read so far are still written and checkpointed.
+                    log.error(f"skipping {chat}: {exc}")
+                    self.failed.append(chat)
+        finally:
+            await self._queue.put(None)
+
+    async def _comments_of(self, chat: str, msg) -> List[Dict]:
+        async with self._comment_slots:
+            return await fetch_comments(self.client, chat, msg)
+
+    async def _read(self, chat: str) -> None:
+        last_id = self.state.get(checkpoint_key(chat, self.name)) or 0
+        if last_id:
+            log.info(f"resuming {chat} after message {last_id}")
+        else:
+            log.info(f"scraping {chat}")
+        count = 0
+        while True:
+            try:
+                async for msg in self.client.iter_messages(
+                    chat,
+                    reverse=True,
+                    min_id=last_id,
+                    offset_date=self.since,
+                    search=self.search or None,
+                ):
+                    if self.until is not None and msg.date >= self.until:
+                        log.info(f"read {chat}: {count} message(s)")
+                        return
+                    comments = None
+                    if self.comments and reply_count(msg):
+                        comments = asyncio.create_task(self._comments_of(chat, msg))
+                        self.comment_fetches += 1
+                    await self._queue.put((chat, msg, comments))
+                    last_id = msg.id
+                    count += 1
+                    self.read += 1
+                    if count % 1000 == 0:
+                        log.info(f"{chat}: {count} message(s), last {format_date(msg.date)}")
+                    if self.limit and self.read >= self.limit:
+                        log.info(f"reached --limit {self.limit}")
+                        return
+                break
+            except FloodWaitError as exc:
+                # Longer than TG_FLOOD_SLEEP_MAX; resume after the last message seen.
+                log.warning(f"FloodWait of {exc.seconds}s while reading {chat}")
+                await asyncio.sleep(exc.seconds)
+        log.info(f"read {chat}: {count} message(s)")
+
+    async def _write_all(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            chat, msg, comments = item
+            found = await comments if comments is not None else []
+            await self.writer.write(chat, message_row(chat, msg, found))
+
+
+async def scrape_history(
+    config: Config,
+    channels: List[str],
+    name: str,
+    output_dir: str,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    search: Optional[str],
+    limit: int,
+    comment_concurrency: int,
+    row_group_size: int,
+    file_rows: int,
+) -> None:
+    """Export ``channels`` one after another; ``until`` is exclusive.
+
+    ``comment_concurrency`` of ``0`` skips comments altogether.
+    """
+    state = open_thread_state(config)
+    state.load()
+    state.start()
+
+    async def _checkpoint(last_ids: Dict[str, int]) -> None:
+        for chat, msg_id in last_ids.items():
+            state.mark(checkpoint_key(chat, name), msg_id)
+        await state.flush()
+
+    writer = RollingParquetWriter(output_dir, name, row_group_size, file_rows, _checkpoint)
+
+    async with get_client(
+        config.api_id,
+        config.api_hash,
+        config.sessions[0],
+        config.tg_rate_limits,
+        config.tg_flood_sleep_max,
+    ) as client:
+        export = HistoryExport(
+            client, state, writer, name, since, until, search, limit, comment_concurrency
+        )
+        try:
+            await export.run(channels)
+        finally:
+            await writer.close()
+            await state.close()
+    log.info(
+        f"exported {writer.rows} message(s) to {len(writer.files)} file(s), "
+        f"comments fetched for {export.comment_fetches}"
+    )
+    if export.failed:
+        log.warning(f"channels skipped after errors: {', '.join(export.failed)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--channels",
+        help="Comma separated channels to export (default: TG_CHANNELS)",
+    )
+    parser.add_argument(
+        "--name",
+        default="history",
+        help="Name of the export; prefix of the output files and key of its resume points",
+    )
+    parser.add_argument("--output-dir", default="./data/history", help="Directory for the Parquet files")
+    parser.add_argument("--since", type=parse_date, help="Oldest date to export (YYYY-MM-DD, UTC)")
+    parser.add_argument(
+        "--until", type=parse_date, help="Newest date to export, inclusive (YYYY-MM-DD, UTC)"
+    )
+    parser.add_argument("--search", help="Only export messages matching this keyword")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after this many messages (0 for no limit)")
+    parser.add_argument(
+        "--no-comments", action="store_true", help="Do not fetch the comments of each message"
+    )
+    parser.add_argument(
+        "--comment-concurrency",
+        type=int,
+        default=4,
+        help="Comment threads fetched at once while messages are read",
+    )
+    parser.add_argument(
+        "--row-group-size",
+        type=int,
+        default=1000,
+        help="Rows buffered in memory and written per Parquet row group",
+    )
+    parser.add_argument(
+        "--file-rows",
+        type=int,
+        default=100000,
+        help="Rows per output file before a new file is started",
+    )
+    args = parser.parse_args()
+
+    config = load_config()
+    setup_logging(config.log_level)
+    channels = (
+        [c.strip() for c in args.channels.split(",") if c.strip()]
+        if args.channels
+        else config.channels
+    )
+    asyncio.run(
+        scrape_history(
+            config,
+            channels,
+            args.name,
+            args.output_dir,
+            args.since,
+            args.until + timedelta(days=1) if args.until else None,
+            args.search,
+            args.limit,
+            0 if args.no_comments else args.comment_concurrency,
+            args.row_group_size,
+            args.file_rows,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
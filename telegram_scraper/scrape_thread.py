@@ -1,99 +1,162 @@
 import argparse
 import asyncio
 import logging
-from typing import AsyncIterator
+import time
+from typing import AsyncIterator, List
 
+from telethon.errors import FloodWaitError
 from telethon.tl.types import Message
 
 from .client import get_client
 from .config import Config, load_config
-from .media import download_all_for_message
-from .sender import send_batch_to_n8n, send_to_n8n
-from .utils import format_reaction, sanitize_text, setup_logging
+from .delivery import deliver, wants_files
+from .janitor import close_janitor
+from .media import close_downloads
+from .media_cache import close_cache
+from .pacing import AdaptivePacer
+from .record import build_payload
+from .sender import close_session
+from .state import open_thread_state
+from .utils import setup_logging
 
 log = logging.getLogger(__name__)
 
 
-async def iter_thread_messages(client, chat: str, thread_msg_id: int) -> AsyncIterator[Message]:
-    async for m in client.iter_messages(chat, reply_to=thread_msg_id, reverse=True):
+async def iter_thread_messages(
+    client, chat: str, thread_msg_id: int, min_id: int = 0
+) -> AsyncIterator[Message]:
+    async for m in client.iter_messages(
+        chat, reply_to=thread_msg_id, reverse=True, min_id=min_id
+    ):
         yield m
 
 
-async def scrape_thread(config: Config, delay: float) -> None:
+async def iter_thread_groups(
+    client, chat: str, thread_msg_id: int, pacer: AdaptivePacer, min_id: int = 0
+) -> AsyncIterator[List[Message]]:
+    """Yield thread messages of ``chat`` after ``min_id``, albums grouped together.
+
+    A FloodWait while listing pauses the pacer and resumes after the last
+    message seen.
+    """
+    current_gid = None
+    pending: List[Message] = []
+    last_id = min_id
+    while True:
+        try:
+            async for msg in iter_thread_messages(client, chat, thread_msg_id, last_id):
+                last_id = msg.id
+                gid = getattr(msg, "grouped_id", None)
+                if gid and (current_gid is None or gid == current_gid):
+                    current_gid = gid
+                    pending.append(msg)
+                    continue
+                if pending:
+                    yield pending
+                if gid:
+                    pending, current_gid = [msg], gid
+                else:
+                    pending, current_gid = [], None
+                    yield [msg]
+            break
+        except FloodWaitError as exc:
+            pacer.flood_wait(exc.seconds)
+            await asyncio.sleep(exc.seconds)
+    if pending:
+        yield pending
+
+
+def checkpoint_key(chat: str, thread_msg_id: int) -> str:
+    return f"thread:{chat.lstrip('@').lower()}:{thread_msg_id}"
+
+
+async def scrape_thread(
+    config: Config, delay: float, max_concurrency: int, max_rate: float
+) -> None:
     if not config.thread_message_id:
         raise ValueError("THREAD_MESSAGE_ID is not set; please add it to .env")
 
-    async with get_client(config.api_id, config.api_hash) as client:
-        async def _send_group(messages, chat_name):
+    pacer = AdaptivePacer(max_concurrency, max_rate, delay)
+    channel_slots = asyncio.Semaphore(max(1, max_concurrency))
+
+    state = open_thread_state(config)
+    state.load()
+    state.start()
+
+    async with get_client(
+        config.api_id,
+        config.api_hash,
+        config.sessions[0],
+        config.tg_rate_limits,
+        config.tg_flood_sleep_max,
+    ) as client:
+        async def _send_group(messages, chat_name) -> bool:
             first = messages[0]
-            has_media = any(bool(m.media) for m in messages)
-            data = {
-                "group": chat_name.lstrip("@"),
-                "author_id": first.sender_id,
-                "content": sanitize_text(first.text or ""),
-                "date": first.date.strftime("%Y-%m-%d %H:%M:%S") if first.date else "",
-                "message_id": first.id,
-                "author": getattr(first, "post_author", None),
-                "views": getattr(first, "views", None),
-                "reactions": " ".join(
-                    format_reaction(r) for r in getattr(first.reactions, "results", [])
-                ),
-                "shares": getattr(first, "forwards", None),
-                "media": has_media,
-                "url": f"https://t.me/{chat_name.lstrip('@')}/{first.id}",
-                "comments_list": [],
-                "thread_message_id": config.thread_message_id,
-                "mode": "bulk_thread_export",
-                "album_group_id": getattr(first, "grouped_id", None),
-                "has_media": has_media,
-                "media_count": 0,
-            }
-            if (
-                config.media_download
-                and has_media
-                and config.media_send_mode == "multipart"
-            ):
-                file_items = []
-                for m in messages:
-                    file_items.extend(
-                        await download_all_for_message(
-                            client, m, config.media_dir, config.media_max_mb
-                        )
+            await pacer.acquire()
+            started = time.monotonic()
+            data = None
+            ok = False
+            try:
+                data = build_payload(
+                    chat_name,
+                    messages,
+                    thread_message_id=config.thread_message_id,
+                    mode="bulk_thread_export",
+                )
+                ok = await deliver(client, config, data, messages)
+            finally:
+                # Media downloads would skew the webhook latency signal.
+                if data is None or wants_files(config, data):
+                    latency = None
+                else:
+                    latency = time.monotonic() - started
+                await pacer.release(latency, ok)
+            if not ok:
+                log.warning("delivery of %s/%s failed", chat_name, first.id)
+            return ok
+
+        async def _export(chat: str) -> None:
+            """Send the thread of ``chat`` group by group, in thread order.
+
+            The checkpoint follows the delivered groups; after a failed group
+            it stays put, so the next run resumes from that group.
+            """
+            key = checkpoint_key(chat, config.thread_message_id)
+            resume_from = state.get(key) or 0
+            failed = False
+            async with channel_slots:
+                if resume_from:
+                    log.info(
+                        f"resuming thread {config.thread_message_id} in {chat} after {resume_from}"
                     )
-                data["media_count"] = len(file_items)
-                send_batch_to_n8n(data, file_items, config)
-            else:
-                if has_media:
-                    data["media_count"] = len(messages)
-                send_to_n8n(data, config)
-
-        for chat in config.channels:
-            log.info(f"scraping thread {config.thread_message_id} in {chat}")
-            current_gid = None
-            pending = []
-            async for msg in iter_thread_messages(client, chat, config.thread_message_id):
-                gid = getattr(msg, "grouped_id", None)
-                if gid:
-                    if current_gid is None or gid == current_gid:
-                        current_gid = gid
-                        pending.append(msg)
-                        continue
-                    await _send_group(pending, chat)
-                    await asyncio.sleep(delay)
-                    pending = [msg]
-                    current_gid = gid
                 else:
-                    if pending:
-                        await _send_group(pending, chat)
-                        await asyncio.sleep(delay)
-                        pending = []
-                        current_gid = None
-                    await _send_group([msg], chat)
-                    await asyncio.sleep(delay)
-            if pending:
-                await _send_group(pending, chat)
-                await asyncio.sleep(delay)
-            log.info(f"done thread {config.thread_message_id} in {chat}")
+                    log.info(f"scraping thread {config.thread_message_id} in {chat}")
+                async for group in iter_thread_groups(
+                    client, chat, config.thread_message_id, pacer, resume_from
+                ):
+                    if not await _send_group(group, chat):
+                        failed = True
+                    elif not failed:
+                        state.mark(key, group[-1].id)
+            log.info(f"done thread {config.thread_message_id} in {chat} ({pacer.describe()})")
+
+        try:
+            # Channels are exported in parallel; one failing does not stop the rest.
+            results = await asyncio.gather(
+                *(_export(chat) for chat in config.channels), return_exceptions=True
+            )
+            for chat, result in zip(config.channels, results):
+                if isinstance(result, BaseException):
+                    log.error(
+                        f"export of thread {config.thread_message_id} in {chat} failed",
+                        exc_info=result,
+                    )
+        finally:
+            await state.close()
+    await close_session()
+    await close_janitor()
+    close_cache()
+    close_downloads()
 
 
 def main() -> None:
@@ -102,13 +165,25 @@ def main() -> None:
         "--delay",
         type=float,
         default=3,
-        help="Delay between sending messages to the webhook in seconds",
+        help="Initial delay between webhook sends in seconds; adapted while running",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=8,
+        help="Upper limit for channels and webhook sends processed at once",
+    )
+    parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=10,
+        help="Upper limit for webhook sends started per second (0 for no limit)",
     )
     args = parser.parse_args()
 
     config = load_config()
     setup_logging(config.log_level)
-    asyncio.run(scrape_thread(config, args.delay))
+    asyncio.run(scrape_thread(config, args.delay, args.max_concurrency, args.max_rate))
 
 
 if __name__ == "__main__":
@@ -1,112 +1,364 @@
 """HTTP sender to forward messages to n8n webhook."""
 from __future__ import annotations
 
-import json
+import asyncio
 import logging
-import os
 import time
 from contextlib import ExitStack
-from typing import Dict, List, Tuple
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 
-import requests
+import aiohttp
 
 from .config import Config
+from .metrics import record_webhook
+from .record import JSON_HEADERS, encode_json
 
 logger = logging.getLogger(__name__)
 
+_session: Optional[aiohttp.ClientSession] = None
+_batchers: Dict[str, "WebhookBatcher"] = {}
 
-def send_to_n8n(data: Dict, config: Config) -> None:
-    """Send data to the configured n8n webhook with retry/backoff."""
+# Unresolved payloads a batcher accepts from enqueue, in batches.
+MAX_PENDING_BATCHES = 4
+
+
+def get_session(config: Config) -> aiohttp.ClientSession:
+    """Return the shared keep-alive HTTP session, creating it on first use."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=config.http_pool_size,
+            keepalive_timeout=config.http_keepalive_seconds,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=config.http_timeout,
+                sock_read=config.http_timeout,
+            ),
+        )
+    return _session
+
+
+async def flush_batches() -> None:
+    """Send every buffered batch and wait until all batches are answered."""
+    for batcher in list(_batchers.values()):
+        await batcher.close()
+
+
+async def close_session() -> None:
+    """Flush pending batches and close the shared HTTP session."""
+    global _session
+    await flush_batches()
+    _batchers.clear()
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def send_to_n8n(data: Dict, config: Config) -> bool:
+    """Send data to the configured n8n webhook with retry/backoff.
+
+    Returns ``True`` once the webhook acknowledged the message and ``False``
+    when all retries were exhausted.
+    """
+    session = get_session(config)
+    body = encode_json(data)
+    channels = [data.get("group", "")]
     for attempt in range(1, config.http_max_retries + 1):
+        started = time.monotonic()
         try:
-            response = requests.post(
-                config.webhook_url, json=data, timeout=config.http_timeout
-            )
-            if response.ok:
-                logger.info("sent message %s", data.get("message_id"))
-                return
-            logger.warning("webhook responded with %s: %s", response.status_code, response.text)
+            async with session.post(
+                config.webhook_url, data=body, headers=JSON_HEADERS
+            ) as response:
+                record_webhook(channels, response.status, started, attempt)
+                if response.ok:
+                    logger.info("sent message %s", data.get("message_id"))
+                    return True
+                logger.warning(
+                    "webhook responded with %s: %s", response.status, await response.text()
+                )
         except Exception as exc:  # pragma: no cover - best effort
+            record_webhook(channels, "error", started, attempt)
             logger.warning("error sending webhook: %s", exc)
-        time.sleep(config.http_backoff_seconds * attempt)
+        await asyncio.sleep(config.http_backoff_seconds * attempt)
+    return False
+
 
+class WebhookBatcher:
+    """Collect JSON payloads for one webhook and post them together.
+
+    A batch is sent once ``config.webhook_batch_size`` payloads are waiting or
+    ``config.webhook_batch_ms`` milliseconds after its first payload arrived.
+    The body is a JSON array (``json``) or one JSON document per line
+    (``ndjson``). Network errors and 5xx responses are retried for the whole
+    batch; a 4xx rejection splits the batch in half and each half is sent on
+    its own, so one bad payload only fails itself.
+
+    :meth:`enqueue` does not wait for the batch to be sent, so one caller can
+    feed many payloads into a batch; it only waits while
+    :data:`MAX_PENDING_BATCHES` batches worth of payloads are unresolved.
+    """
+
+    def __init__(self, url: str, config: Config) -> None:
+        self.url = url
+        self.config = config
+        self._items: List[Tuple[Dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: set = set()
+        self._pending = asyncio.Semaphore(config.webhook_batch_size * MAX_PENDING_BATCHES)
+
+    def _add(self, data: Dict) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._items.append((data, future))
+        if len(self._items) >= self.config.webhook_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(
+                self.config.webhook_batch_ms / 1000, self._flush
+            )
+        return future
+
+    async def submit(self, data: Dict) -> bool:
+        """Queue ``data`` for the next batch and wait for its outcome."""
+        return await self._add(data)
+
+    async def enqueue(self, data: Dict) -> asyncio.Future:
+        """Queue ``data`` and return the future of its outcome without awaiting it."""
+        await self._pending.acquire()
+        future = self._add(data)
+        future.add_done_callback(lambda _f: self._pending.release())
+        return future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._items:
+            return
+        items, self._items = self._items, []
+        task = asyncio.get_running_loop().create_task(self._deliver(items))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, items: List[Tuple[Dict, asyncio.Future]]) -> None:
+        try:
+            ok, rejected = await self._post([data for data, _ in items])
+        except Exception:
+            # Callers only learn the outcome through the futures.
+            logger.exception("batch of %s failed", len(items))
+            ok, rejected = False, False
+        if rejected:
+            middle = len(items) // 2
+            logger.warning("batch of %s rejected, splitting", len(items))
+            await self._deliver(items[:middle])
+            await self._deliver(items[middle:])
+            return
+        for _, future in items:
+            if not future.done():
+                future.set_result(ok)
+
+    async def _post(self, batch: List[Dict]) -> Tuple[bool, bool]:
+        """Post ``batch`` and return ``(delivered, rejected)``."""
+        config = self.config
+        if config.webhook_batch_format == "ndjson":
+            kwargs: Dict = {
+                "data": b"".join(encode_json(d) + b"\n" for d in batch),
+                "headers": {"Content-Type": "application/x-ndjson"},
+            }
+        else:
+            kwargs = {"data": encode_json(batch), "headers": JSON_HEADERS}
+        session = get_session(config)
+        channels = [d.get("group", "") for d in batch]
+        for attempt in range(1, config.http_max_retries + 1):
+            started = time.monotonic()
+            try:
+                async with session.post(self.url, **kwargs) as response:
+                    record_webhook(channels, response.status, started, attempt)
+                    if response.ok:
+                        logger.info("sent batch of %s message(s)", len(batch))
+                        return True, False
+                    logger.warning(
+                        "webhook responded with %s: %s",
+                        response.status,
+                        await response.text(),
+                    )
+                    if (
+                        len(batch) > 1
+                        and 400 <= response.status < 500
+                        and response.status not in (408, 429)
+                    ):
+                        return False, True
+            except Exception as exc:  # pragma: no cover - best effort
+                record_webhook(channels, "error", started, attempt)
+                logger.warning("error sending batch webhook: %s", exc)
+            await asyncio.sleep(config.http_backoff_seconds * attempt)
+        return False, False
 
-def send_batch_to_n8n(
-    data: Dict, file_items: List[Tuple[str, str | None]], config: Config
-) -> None:
+    async def close(self) -> None:
+        """Send whatever is still buffered and wait for in-flight batches."""
+        self._flush()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+
+def _batcher(config: Config) -> WebhookBatcher:
+    batcher = _batchers.get(config.webhook_url)
+    if batcher is None:
+        batcher = _batchers[config.webhook_url] = WebhookBatcher(
+            config.webhook_url, config
+        )
+    return batcher
+
+
+async def submit_to_n8n(data: Dict, config: Config) -> bool:
+    """Send a JSON payload, batching it when ``WEBHOOK_BATCH_SIZE`` > 1."""
+    if config.webhook_batch_size <= 1:
+        return await send_to_n8n(data, config)
+    return await _batcher(config).submit(data)
+
+
+async def enqueue_to_n8n(data: Dict, config: Config) -> asyncio.Future:
+    """Add a JSON payload to the next batch; the future resolves to its outcome."""
+    return await _batcher(config).enqueue(data)
+
+
+async def send_batch_to_n8n(
+    data: Dict, file_items: List[Tuple[str, str | None, str]], config: Config
+) -> bool:
     """Send ``data`` and ``file_items`` to n8n in a single request.
 
-    If ``file_items`` is empty the call falls back to ``send_to_n8n``. When
-    files are present they are sent as ``files[]`` fields in multipart/form-data
-    together with a ``payload`` field containing JSON metadata. The request uses
-    the same retry/backoff logic as :func:`send_to_n8n`.
+    ``file_items`` holds ``(path, mimetype, filename)`` triples. If it is
+    empty the call falls back to ``send_to_n8n``. When files are present they
+    are sent as ``files[]`` fields in multipart/form-data together with a
+    ``payload`` field containing JSON metadata. The request uses the same
+    retry/backoff logic as :func:`send_to_n8n`.
     """
 
     items = list(file_items)
     if not items:
-        send_to_n8n(data, config)
-        return
+        return await send_to_n8n(data, config)
 
+    session = get_session(config)
+    channels = [data.get("group", "")]
     for attempt in range(1, config.http_max_retries + 1):
+        started = time.monotonic()
         try:
             with ExitStack() as stack:
-                files = []
-                for path, mimetype in items:
+                form = aiohttp.FormData()
+                # As str: aiohttp turns a bytes value into a file part.
+                form.add_field("payload", encode_json(data).decode())
+                for path, mimetype, filename in items:
                     fh = stack.enter_context(open(path, "rb"))
-                    files.append(
-                        (
-                            "files[]",
-                            (
-                                os.path.basename(path),
-                                fh,
-                                mimetype or "application/octet-stream",
-                            ),
+                    form.add_field(
+                        "files[]",
+                        fh,
+                        filename=filename,
+                        content_type=mimetype or "application/octet-stream",
+                    )
+                async with session.post(config.webhook_url, data=form) as response:
+                    record_webhook(channels, response.status, started, attempt)
+                    if response.ok:
+                        logger.info(
+                            "sent batch %s with %s file(s) and payload",
+                            data.get("album_group_id") or data.get("message_id"),
+                            len(items),
                         )
+                        return True
+                    logger.warning(
+                        "webhook responded with %s: %s",
+                        response.status,
+                        await response.text(),
                     )
-                response = requests.post(
-                    config.webhook_url,
-                    files=files,
-                    data={"payload": json.dumps(data)},
-                    timeout=config.http_timeout,
-                )
-            if response.ok:
-                logger.info(
-                    "sent batch %s with %s file(s) and payload",
-                    data.get("album_group_id") or data.get("message_id"),
-                    len(items),
-                )
-                return
-            logger.warning(
-                "webhook responded with %s: %s", response.status_code, response.text
-            )
         except Exception as exc:  # pragma: no cover - best effort
+            record_webhook(channels, "error", started, attempt)
             logger.warning("error sending batch webhook: %s", exc)
-        time.sleep(config.http_backoff_seconds * attempt)
+        await asyncio.sleep(config.http_backoff_seconds * attempt)
+    return False
 
 
-def send_file_to_n8n(
+async def send_file_to_n8n(
     data: Dict, file_path: str, filename: str, mimetype: str | None, config: Config
-) -> None:
+) -> bool:
     """Send a file with accompanying payload to n8n via multipart/form-data."""
+    session = get_session(config)
+    channels = [data.get("group", "")]
     for attempt in range(1, config.http_max_retries + 1):
+        started = time.monotonic()
         try:
             with open(file_path, "rb") as fh:
-                files = {
-                    "file": (filename, fh, mimetype or "application/octet-stream"),
-                }
-                payload = {"payload": json.dumps(data)}
-                response = requests.post(
-                    config.webhook_url,
-                    files=files,
-                    data=payload,
-                    timeout=config.http_timeout,
+                form = aiohttp.FormData()
+                form.add_field("payload", encode_json(data).decode())
+                form.add_field(
+                    "file",
+                    fh,
+                    filename=filename,
+                    content_type=mimetype or "application/octet-stream",
                 )
-            if response.ok:
-                logger.info("sent file %s", filename)
-                return
-            logger.warning(
-                "webhook responded with %s: %s", response.status_code, response.text
-            )
+                async with session.post(config.webhook_url, data=form) as response:
+                    record_webhook(channels, response.status, started, attempt)
+                    if response.ok:
+                        logger.info("sent file %s", filename)
+                        return True
+                    logger.warning(
+                        "webhook responded with %s: %s",
+                        response.status,
+                        await response.text(),
+                    )
         except Exception as exc:  # pragma: no cover - best effort
+            record_webhook(channels, "error", started, attempt)
             logger.warning("error sending file webhook: %s", exc)
-        time.sleep(config.http_backoff_seconds * attempt)
+        await asyncio.sleep(config.http_backoff_seconds * attempt)
+    return False
+
+
+async def send_stream_to_n8n(
+    data: Dict,
+    streams: List[Tuple[str, str | None, Callable[[], AsyncIterator[bytes]]]],
+    config: Config,
+) -> bool:
+    """Send ``data`` and streamed files to n8n in a single multipart request.
+
+    ``streams`` holds ``(filename, mimetype, source)`` triples; ``source()``
+    returns an async iterator of chunks that is piped into the request body
+    as it arrives, so no file touches the disk. Each retry starts fresh
+    streams. Without streams the call falls back to ``send_to_n8n``.
+    """
+    if not streams:
+        return await send_to_n8n(data, config)
+
+    session = get_session(config)
+    channels = [data.get("group", "")]
+    for attempt in range(1, config.http_max_retries + 1):
+        started = time.monotonic()
+        try:
+            form = aiohttp.FormData()
+            form.add_field("payload", encode_json(data).decode())
+            for filename, mimetype, source in streams:
+                form.add_field(
+                    "files[]",
+                    source(),
+                    filename=filename,
+                    content_type=mimetype or "application/octet-stream",
+                )
+            async with session.post(config.webhook_url, data=form) as response:
+                record_webhook(channels, response.status, started, attempt)
+                if response.ok:
+                    logger.info(
+                        "streamed batch %s with %s file(s) and payload",
+                        data.get("album_group_id") or data.get("message_id"),
+                        len(streams),
+                    )
+                    return True
+                logger.warning(
+                    "webhook responded with %s: %s",
+                    response.status,
+                    await response.text(),
+                )
+        except Exception as exc:  # pragma: no cover - best effort
+            record_webhook(channels, "error", started, attempt)
+            logger.warning("error streaming batch webhook: %s", exc)
+        await asyncio.sleep(config.http_backoff_seconds * attempt)
+    return False
@@ -1,9 +1,20 @@
 """Persistent state storage for last processed message IDs."""
 from __future__ import annotations
 
+import asyncio
 import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional, Union
+
+from .config import Config
+from .metrics import STATE_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
 
 
 def load_state(path: str) -> Dict[str, int]:
@@ -14,11 +25,217 @@ def load_state(path: str) -> Dict[str, int]:
     except FileNotFoundError:
         return {}
     except json.JSONDecodeError:
+        logger.warning("state file %s is corrupt, starting from empty state", path)
         return {}
 
 
 def save_state(path: str, state: Dict[str, int]) -> None:
-    """Save state to a JSON file."""
-    Path(path).parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as fh:
-        json.dump(state, fh)
+    """Atomically save state to a JSON file.
+
+    The data is written to a temporary file in the same directory, fsynced and
+    renamed over ``path``, so a crash leaves either the old or the new file.
+    """
+    directory = Path(path).parent
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".state-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(state, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class FileStateStore:
+    """State stored as a single JSON document."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._state: Dict[str, int] = {}
+
+    def load(self) -> Dict[str, int]:
+        self._state = load_state(self.path)
+        return dict(self._state)
+
+    def write(self, updates: Dict[str, int]) -> None:
+        self._state.update(updates)
+        save_state(self.path, self._state)
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteStateStore:
+    """State stored in SQLite, one row per channel.
+
+    The database runs in WAL mode with ``synchronous=NORMAL`` and every
+    :meth:`write` is a single transaction, so a batch of channel updates
+    shares one commit.
+    """
+
+    def __init__(self, path: str, legacy_file: Optional[str] = None) -> None:
+        self.path = path
+        self.legacy_file = legacy_file
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS channel_state ("
+            " chat TEXT PRIMARY KEY,"
+            " last_message_id INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def _migrate(self) -> None:
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM channel_state").fetchone()
+        if count:
+            return
+        legacy = load_state(self.legacy_file)
+        self.write(legacy)
+        os.replace(self.legacy_file, self.legacy_file + ".migrated")
+        logger.info(
+            "migrated %s channel(s) from %s to %s", len(legacy), self.legacy_file, self.path
+        )
+
+    def load(self) -> Dict[str, int]:
+        self._migrate()
+        rows = self._conn.execute("SELECT chat, last_message_id FROM channel_state")
+        return {chat: msg_id for chat, msg_id in rows}
+
+    def write(self, updates: Dict[str, int]) -> None:
+        """Write ``updates`` in a single transaction."""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO channel_state (chat, last_message_id, updated_at)"
+                " VALUES (?, ?, ?)"
+                " ON CONFLICT(chat) DO UPDATE SET"
+                " last_message_id = excluded.last_message_id,"
+                " updated_at = excluded.updated_at",
+                [(chat, msg_id, now) for chat, msg_id in updates.items()],
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+StateStore = Union[FileStateStore, SqliteStateStore]
+
+
+class Checkpointer:
+    """Coalesce state updates in memory and flush them off the event loop.
+
+    :meth:`mark` only updates the in-memory map. Dirty entries are written to
+    the store at least every ``interval`` seconds, or as soon as
+    ``max_updates`` updates are pending, and once more on :meth:`close`.
+    """
+
+    def __init__(self, store: StateStore, interval: float, max_updates: int) -> None:
+        self.store = store
+        self.interval = interval
+        self.max_updates = max(1, max_updates)
+        self._state: Dict[str, int] = {}
+        self._dirty: Dict[str, int] = {}
+        self._updates = 0
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def load(self) -> Dict[str, int]:
+        self._state = self.store.load()
+        return dict(self._state)
+
+    def start(self) -> None:
+        """Start the background flush task on the running loop."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def get(self, chat: str) -> Optional[int]:
+        return self._state.get(chat)
+
+    def mark(self, chat: str, msg_id: int) -> None:
+        """Record ``msg_id`` as processed for ``chat`` (ids never go back)."""
+        if msg_id <= self._state.get(chat, 0):
+            return
+        self._state[chat] = msg_id
+        self._dirty[chat] = msg_id
+        self._updates += 1
+        if self._updates >= self.max_updates:
+            self._wakeup.set()
+
+    async def flush(self) -> None:
+        """Write all dirty entries to the store."""
+        async with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            self._updates = 0
+            started = time.monotonic()
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.store.write, dirty
+                )
+                STATE_FLUSH_SECONDS.observe(time.monotonic() - started)
+            except Exception:
+                for chat, msg_id in dirty.items():
+                    self._dirty.setdefault(chat, msg_id)
+                raise
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as exc:  # pragma: no cover - best effort
+                logger.warning("error flushing state: %s", exc)
+
+    async def close(self) -> None:
+        """Stop the flush task, write remaining updates and close the store."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        self.store.close()
+
+
+def open_state(config: Config) -> Checkpointer:
+    """Return a checkpointer over the store selected by ``config.state_backend``."""
+    store: StateStore
+    if config.state_backend == "file":
+        store = FileStateStore(config.state_file)
+    elif config.state_backend == "sqlite":
+        store = SqliteStateStore(config.state_db, legacy_file=config.state_file)
+    else:
+        raise ValueError(f"Unknown STATE_BACKEND {config.state_backend!r}")
+    return Checkpointer(store, config.state_flush_ms / 1000, config.state_flush_every)
+
+
+def open_thread_state(config: Config) -> Checkpointer:
+    """Return a checkpointer for bulk thread exports.
+
+    With the file backend the checkpoints live in ``config.thread_state_file``
+    so an export never rewrites the live listener's state file; with SQLite
+    they are rows of the same database under their own keys.
+    """
+    store: StateStore
+    if config.state_backend == "file":
+        store = FileStateStore(config.thread_state_file)
+    elif config.state_backend == "sqlite":
+        store = SqliteStateStore(config.state_db)
+    else:
+        raise ValueError(f"Unknown STATE_BACKEND {config.state_backend!r}")
+    return Checkpointer(store, config.state_flush_ms / 1000, config.state_flush_every)
@@ -0,0 +1,206 @@
+"""Multi-process runner that splits the channel list into shards.
+
+With ``SHARDS`` greater than one, :func:`supervise` starts one worker process
+per shard. Every shard gets a fixed subset of the channels and of the
+Telegram sessions, and its own state, outbox and media directories, so the
+workers share nothing but the webhook. A worker that exits is restarted on
+its own with an exponential backoff while the other shards keep running.
+"""
+from __future__ import annotations
+
+import dataclasses
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import zlib
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+
+from .config import Config
+from .state import open_state
+
+logger = logging.getLogger(__name__)
+
+# Longest pause between two restarts of a crashing shard.
+MAX_RESTART_DELAY = 300
+# A worker that stayed up this long is considered healthy again.
+HEALTHY_UPTIME = 60
+
+
+def shard_of(channel: str, shards: int) -> int:
+    """Return the shard index that owns ``channel``."""
+    return zlib.crc32(channel.lower().encode("utf-8")) % shards
+
+
+def _suffix_file(path: str, index: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{index}{ext}"
+
+
+def shard_config(config: Config, index: int) -> Config:
+    """Return the configuration of shard ``index`` of ``config.shards``."""
+    count = config.shards
+    return dataclasses.replace(
+        config,
+        channels=[c for c in config.channels if shard_of(c, count) == index],
+        sessions=config.sessions[index::count],
+        state_file=_suffix_file(config.state_file, index),
+        state_db=_suffix_file(config.state_db, index),
+        chat_cache_file=_suffix_file(config.chat_cache_file, index),
+        outbox_dir=os.path.join(config.outbox_dir, f"shard-{index}"),
+        media_dir=os.path.join(config.media_dir, f"shard-{index}"),
+        media_cache_dir=os.path.join(config.media_cache_dir, f"shard-{index}"),
+        media_cache_mb=config.media_cache_mb // count,
+        media_retention_mb=config.media_retention_mb // count,
+        metrics_port=config.metrics_port + index if config.metrics_port > 0 else 0,
+    )
+
+
+def _seed_state(config: Config, shards: List[Config]) -> None:
+    """Copy last message ids from the unsharded state into empty shard states."""
+    source = open_state(config).store
+    try:
+        legacy = source.load()
+    finally:
+        source.close()
+    if not legacy:
+        return
+    for shard in shards:
+        store = open_state(shard).store
+        try:
+            if store.load():
+                continue
+            owned = {c.lower() for c in shard.channels}
+            subset = {chat: msg_id for chat, msg_id in legacy.items() if chat.lower() in owned}
+            if subset:
+                store.write(subset)
+        finally:
+            store.close()
+
+
+def _adopt_outbox(config: Config, first: Config) -> None:
+    """Move segments of the unsharded outbox into shard 0 so they are replayed."""
+    try:
+        names = [n for n in os.listdir(config.outbox_dir) if n.endswith(".log")]
+    except FileNotFoundError:
+        return
+    if not names:
+        return
+    os.makedirs(first.outbox_dir, exist_ok=True)
+    if any(n.endswith(".log") for n in os.listdir(first.outbox_dir)):
+        return
+    for name in names:
+        os.replace(os.path.join(config.outbox_dir, name), os.path.join(first.outbox_dir, name))
+    logger.info("moved %s outbox segment(s) to %s", len(names), first.outbox_dir)
+
+
+def _worker(config: Config, index: int) -> None:
+    from .run import run_shard
+
+    run_shard(config, f"shard-{index}")
+
+
+class Supervisor:
+    """Start, watch and restart one worker process per shard."""
+
+    def __init__(self, config: Config, restart_delay: float) -> None:
+        if len(config.sessions) < config.shards:
+            raise ValueError(
+                f"SHARDS={config.shards} needs at least as many TG_SESSIONS "
+                f"({len(config.sessions)} given); a session file cannot be shared "
+                "between processes"
+            )
+        self.config = config
+        self.restart_delay = restart_delay
+        self.shards = [shard_config(config, i) for i in range(config.shards)]
+        self._ctx = multiprocessing.get_context("spawn")
+        self._procs: Dict[int, multiprocessing.process.BaseProcess] = {}
+        self._started: Dict[int, float] = {}
+        self._failures: Dict[int, int] = {}
+        self._restart_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def _start(self, index: int) -> None:
+        proc = self._ctx.Process(
+            target=_worker, args=(self.shards[index], index), name=f"shard-{index}"
+        )
+        proc.start()
+        self._procs[index] = proc
+        self._started[index] = time.monotonic()
+        logger.info(
+            "started shard %s (pid %s) with %s channel(s) on session(s) %s",
+            index,
+            proc.pid,
+            len(self.shards[index].channels),
+            ",".join(self.shards[index].sessions),
+        )
+
+    def _reap(self, index: int) -> None:
+        proc = self._procs.pop(index)
+        proc.join()
+        uptime = time.monotonic() - self._started[index]
+        if uptime >= HEALTHY_UPTIME:
+            self._failures[index] = 0
+        self._failures[index] = self._failures.get(index, 0) + 1
+        delay = min(self.restart_delay * 2 ** (self._failures[index] - 1), MAX_RESTART_DELAY)
+        self._restart_at[index] = time.monotonic() + delay
+        logger.warning(
+            "shard %s exited with code %s after %.0fs, restarting in %.0fs",
+            index,
+            proc.exitcode,
+            uptime,
+            delay,
+        )
+
+    def _stop(self, *_args) -> None:
+        self._stopping = True
+
+    def run(self) -> None:
+        """Run until SIGINT/SIGTERM, then stop every worker."""
+        signal.signal(signal.SIGTERM, self._stop)
+        _adopt_outbox(self.config, self.shards[0])
+        _seed_state(self.config, self.shards)
+        for index, shard in enumerate(self.shards):
+            if shard.channels:
+                self._start(index)
+            else:
+                logger.warning("shard %s has no channels and is not started", index)
+        try:
+            while not self._stopping:
+                now = time.monotonic()
+                for index, at in list(self._restart_at.items()):
+                    if at <= now:
+                        del self._restart_at[index]
+                        self._start(index)
+                timeout: Optional[float] = 1.0
+                if self._restart_at:
+                    timeout = max(0.0, min(min(self._restart_at.values()) - now, 1.0))
+                ready = wait([p.sentinel for p in self._procs.values()], timeout)
+                for index, proc in list(self._procs.items()):
+                    if proc.sentinel in ready:
+                        self._reap(index)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self, timeout: float = 30) -> None:
+        """Ask every worker to stop and kill the ones that do not."""
+        for proc in self._procs.values():
+            if proc.is_alive():
+                proc.terminate()
+        deadline = time.monotonic() + timeout
+        for proc in self._procs.values():
+            proc.join(max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                logger.warning("shard %s did not stop in time, killing it", proc.name)
+                proc.kill()
+                proc.join()
+        self._procs.clear()
+
+
+def supervise(config: Config) -> None:
+    """Run ``config.channels`` as ``config.shards`` worker processes."""
+    Supervisor(config, config.shard_restart_sec).run()
@@ -7,15 +7,21 @@ from typing import Optional
 
 def format_reaction(r) -> str:
     """Format a Telethon reaction count safely."""
-    return f"{getattr(getattr(r, 'reaction', None), 'emoticon', str(getattr(r, 'reaction', '')))} {r.count}"
+    reaction = getattr(r, "reaction", "")
+    # Only fall back to str() (Telethon's slow pretty-printer) without an emoticon.
+    emoticon = getattr(reaction, "emoticon", None)
+    if emoticon is None:
+        emoticon = str(reaction)
+    return f"{emoticon} {r.count}"
 
 
-def setup_logging(level: str) -> None:
-    """Configure logging with a uniform format."""
+def setup_logging(level: str, tag: Optional[str] = None) -> None:
+    """Configure logging with a uniform format, optionally tagged per process."""
     numeric_level = getattr(logging, level.upper(), logging.INFO)
+    prefix = f"[{tag}] " if tag else ""
     logging.basicConfig(
         level=numeric_level,
-        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        format=f"%(asctime)s {prefix}%(levelname)s %(name)s: %(message)s",
     )
 
 
@@ -0,0 +1,28 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram_scraper.events import AlbumScheduler
+
+
+async def _deliver_twice():
+    flushed = []
+
+    async def on_flush(buf):
+        flushed.append([m.id for m in buf.messages])
+
+    albums = AlbumScheduler(0.01, 100, on_flush)
+    parts = [SimpleNamespace(id=i) for i in (10, 11, 12)]
+    # Catch-up reads the album and flushes it ...
+    for msg in parts:
+        albums.add(7, "chat", msg)
+    await asyncio.sleep(0.05)
+    # ... then the live copies held back during catch-up are replayed.
+    for msg in parts:
+        albums.add(7, "chat", msg)
+    await asyncio.sleep(0.05)
+    await albums.close()
+    return flushed
+
+
+def test_parts_of_a_flushed_album_are_not_delivered_again():
+    assert asyncio.run(_deliver_twice()) == [[10, 11, 12]]
@@ -0,0 +1,104 @@
+import asyncio
+import os
+
+from telethon.tl.types import (
+    GeoPoint,
+    Message,
+    MessageMediaGeo,
+    MessageMediaPhoto,
+    Photo,
+    PhotoSize,
+)
+
+from telegram_scraper import media
+from telegram_scraper.media_cache import MediaCache
+
+
+async def _contend() -> None:
+    # Only a waiting acquire binds the semaphore to the running loop.
+    slots = media._slots(1)
+
+    async def hold() -> None:
+        async with slots:
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(hold(), hold())
+
+
+def test_download_slots_survive_a_loop_restart():
+    asyncio.run(_contend())
+    media.close_downloads()
+    asyncio.run(_contend())
+    media.close_downloads()
+
+
+class _Photo:
+    id = 42
+    access_hash = 7
+
+
+class _Message:
+    id = 1
+    media = True
+    photo = _Photo()
+    file = None
+
+
+class _Client:
+    async def download_media(self, msg, download_dir):
+        path = f"{download_dir}/photo_2024-05-17.jpg"
+        with open(path, "wb") as fh:
+            fh.write(b"jpeg")
+        return path
+
+
+async def _download_twice(tmp_path):
+    cache = MediaCache(str(tmp_path / "cache"), 1 << 20)
+    first = await media.download_one(_Client(), _Message(), str(tmp_path), 10, cache)
+    second = await media.download_one(_Client(), _Message(), str(tmp_path), 10, cache)
+    cache.save()
+    return cache, first, second
+
+
+def test_cached_media_keeps_its_original_file_name(tmp_path):
+    cache, first, second = asyncio.run(_download_twice(tmp_path))
+
+    assert cache.hits == 1
+    assert os.path.dirname(second["file_path"]) == cache.directory
+    assert first["filename"] == second["filename"] == "photo_2024-05-17.jpg"
+    reopened = MediaCache(cache.directory, 1 << 20)
+    assert reopened.name("photo-42-7") == "photo_2024-05-17.jpg"
+
+
+class _ChannelMessage:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+
+
+def test_peer_dir_separates_chats(tmp_path):
+    first = media.peer_dir(str(tmp_path), _ChannelMessage(-1001))
+    second = media.peer_dir(str(tmp_path), _ChannelMessage(-1002))
+
+    assert first != second
+    assert os.path.isdir(first) and os.path.isdir(second)
+
+
+def test_media_metadata_only_describes_files():
+    geo = Message(id=1, peer_id=None, media=MessageMediaGeo(GeoPoint(1.0, 2.0, 0)))
+    photo = Message(
+        id=2,
+        peer_id=None,
+        media=MessageMediaPhoto(
+            photo=Photo(
+                id=3,
+                access_hash=4,
+                file_reference=b"",
+                date=None,
+                sizes=[PhotoSize(type="x", w=800, h=600, size=1000)],
+                dc_id=2,
+            )
+        ),
+    )
+
+    assert media.media_metadata(geo) is None
+    assert media.media_metadata(photo)["type"] == "photo"
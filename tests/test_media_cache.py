@@ -0,0 +1,39 @@
+import asyncio
+import os
+
+from telegram_scraper.media_cache import MediaCache
+
+
+def _download(tmp_path, name: str, size: int) -> str:
+    path = str(tmp_path / name)
+    with open(path, "wb") as fh:
+        fh.write(os.urandom(size))
+    return path
+
+
+async def _store_two(tmp_path):
+    # Room for one file only: storing the second one evicts the first.
+    cache = MediaCache(str(tmp_path / "cache"), 150)
+    first = await cache.store("photo-1-0", _download(tmp_path, "a.jpg", 100))
+    second = await cache.store("photo-2-0", _download(tmp_path, "b.jpg", 100))
+    return cache, first, second
+
+
+def test_files_in_use_are_not_evicted(tmp_path):
+    cache, first, second = asyncio.run(_store_two(tmp_path))
+
+    assert os.path.exists(first) and os.path.exists(second)
+
+    cache.release([first])
+
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+    assert cache.lookup("photo-1-0") is None
+
+
+def test_release_ignores_files_outside_the_cache(tmp_path):
+    cache, first, second = asyncio.run(_store_two(tmp_path))
+    cache.release([str(tmp_path / "preview.jpg"), second])
+
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
@@ -0,0 +1,49 @@
+import asyncio
+
+from telegram_scraper.outbox import Outbox
+
+
+async def _fill(directory: str) -> None:
+    outbox = Outbox(directory, segment_bytes=1 << 20, fsync_interval=0.01)
+    outbox.open()
+    outbox.start()
+    # First segment: 1 and 2; 1 stays pending, so the segment is kept.
+    for _ in range(2):
+        await outbox.append({"chat": "a", "message_ids": [1], "payload": {}})
+    outbox._roll()
+    # Second segment: 3 is put and acked, and it holds the ack of 2.
+    entry = await outbox.append({"chat": "a", "message_ids": [3], "payload": {}})
+    outbox.ack(entry)
+    outbox.ack(2)
+    outbox._roll()
+    # The second segment has no live records left and is dropped.
+    await outbox._compact()
+    await outbox.close()
+
+
+def test_compaction_keeps_acks_of_older_segments(tmp_path):
+    directory = str(tmp_path / "outbox")
+    asyncio.run(_fill(directory))
+
+    reopened = Outbox(directory, segment_bytes=1 << 20, fsync_interval=0.01)
+    pending = reopened.open()
+
+    assert [record["id"] for record in pending] == [1]
+
+
+async def _compact_after_reopen(directory: str) -> None:
+    outbox = Outbox(directory, segment_bytes=1 << 20, fsync_interval=0.01)
+    outbox.open()
+    await outbox._compact()
+    await outbox.close()
+
+
+def test_acks_survive_repeated_compaction(tmp_path):
+    directory = str(tmp_path / "outbox")
+    asyncio.run(_fill(directory))
+    asyncio.run(_compact_after_reopen(directory))
+    asyncio.run(_compact_after_reopen(directory))
+
+    reopened = Outbox(directory, segment_bytes=1 << 20, fsync_interval=0.01)
+
+    assert [record["id"] for record in reopened.open()] == [1]
@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+from telethon.tl import functions
+
+from telegram_scraper.ratelimit import FloodLimiter, method_class
+
+
+def test_replies_and_downloads_have_their_own_classes():
+    replies = functions.messages.GetRepliesRequest(
+        peer="x", msg_id=1, offset_id=0, offset_date=None, add_offset=0,
+        limit=100, max_id=0, min_id=0, hash=0,
+    )
+    get_file = functions.upload.GetFileRequest(location=None, offset=0, limit=1024)
+
+    assert method_class(replies) == "replies"
+    assert method_class(get_file) == "download"
+
+
+async def _download_calls(count: int) -> float:
+    limiter = FloodLimiter()
+    request = functions.upload.GetFileRequest(location=None, offset=0, limit=1024)
+    started = time.monotonic()
+    for _ in range(count):
+        await limiter.acquire(request)
+    return time.monotonic() - started
+
+
+def test_downloads_are_not_token_gated_by_default():
+    assert asyncio.run(_download_calls(500)) < 0.5
+
+
+async def _after_flood() -> float:
+    limiter = FloodLimiter()
+    request = functions.upload.GetFileRequest(location=None, offset=0, limit=1024)
+    bucket = await limiter.acquire(request)
+    bucket.flood(0.2)
+    started = time.monotonic()
+    await limiter.acquire(request)
+    return time.monotonic() - started
+
+
+def test_ungated_class_still_pauses_on_flood_wait():
+    assert asyncio.run(_after_flood()) >= 0.15
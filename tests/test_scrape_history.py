@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telegram_scraper.scrape_history import HistoryExport, fetch_comments
+
+
+class _Client:
+    async def iter_messages(self, chat, **kwargs):
+        if chat == "@missing":
+            raise ValueError("No user has \"missing\" as username")
+        for i in range(1, 4):
+            yield SimpleNamespace(
+                id=i,
+                date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+                replies=None,
+            )
+
+
+class _State:
+    def get(self, key):
+        return None
+
+
+class _Writer:
+    def __init__(self):
+        self.rows = []
+
+    async def write(self, chat, row):
+        self.rows.append((chat, row))
+
+
+def test_failing_channel_is_skipped(monkeypatch):
+    monkeypatch.setattr(
+        "telegram_scraper.scrape_history.message_row", lambda chat, msg, comments: msg.id
+    )
+    writer = _Writer()
+    export = HistoryExport(_Client(), _State(), writer, "t", None, None, None, 0, 4)
+
+    asyncio.run(export.run(["@a", "@missing", "@b"]))
+
+    assert export.failed == ["@missing"]
+    assert writer.rows == [("@a", 1), ("@a", 2), ("@a", 3), ("@b", 1), ("@b", 2), ("@b", 3)]
+
+
+class _Replies:
+    """Comment thread iterator; ``total`` is the thread size Telegram reports."""
+
+    def __init__(self, thread, limit, min_id, reverse):
+        assert reverse
+        self.total = len(thread)
+        found = [c for c in thread if c.id > min_id]
+        self._items = iter(found[:limit] if limit else found)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._items)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _ThreadClient:
+    def __init__(self, thread):
+        self.thread = thread
+        self.calls = 0
+
+    def iter_messages(self, chat, limit, reply_to, reverse, min_id, wait_time):
+        self.calls += 1
+        return _Replies(self.thread, limit, min_id, reverse)
+
+
+def _comment(i):
+    return SimpleNamespace(id=i)
+
+
+def test_comments_posted_after_listing_are_not_cut_off(monkeypatch):
+    monkeypatch.setattr(
+        "telegram_scraper.scrape_history.comment_row",
+        lambda chat, msg, comment: {"Comment Message ID": comment.id},
+    )
+    # Listed with 3 replies; 2 more arrived before the comments were read.
+    msg = SimpleNamespace(id=1, replies=SimpleNamespace(replies=3))
+    client = _ThreadClient([_comment(i) for i in range(10, 15)])
+
+    rows = asyncio.run(fetch_comments(client, "@a", msg))
+
+    assert [r["Comment Message ID"] for r in rows] == [14, 13, 12, 11, 10]
+    assert client.calls == 2
+
+
+def test_up_to_date_reply_count_takes_one_request(monkeypatch):
+    monkeypatch.setattr(
+        "telegram_scraper.scrape_history.comment_row",
+        lambda chat, msg, comment: {"Comment Message ID": comment.id},
+    )
+    msg = SimpleNamespace(id=1, replies=SimpleNamespace(replies=3))
+    client = _ThreadClient([_comment(i) for i in range(10, 13)])
+
+    rows = asyncio.run(fetch_comments(client, "@a", msg))
+
+    assert [r["Comment Message ID"] for r in rows] == [12, 11, 10]
+    assert client.calls == 1